@@ -0,0 +1,143 @@
+from collections import OrderedDict
+import dataclasses
+import hashlib
+import os
+import zipfile
+import numpy as np
+from config import BedParameters, Config
+from gcode import GCodeMove
+from pattern import Pattern, PackedPattern
+
+@dataclasses.dataclass
+class CachedStrokes:
+    """Entry of a LayerCache
+
+    Attributes:
+        strokes: the stroke gcode of the layer
+        mismatching_cells: the result of verifying the layer, see Verifier.mismatching_cells; None when
+            it wasn't verified yet
+    """
+    strokes: str
+    mismatching_cells: list[tuple[int, int]] | None = None
+
+class LayerCache:
+    """Bounded LRU cache with the generated stroke gcode of layers.
+
+    Prints often contain long runs of identical layers. The cache is keyed on a hash of the
+    rasterized pattern, so an identical layer reuses the stroke gcode of an earlier layer
+    instead of encoding it again (only the layer header, with the layer index, differs). When
+    the output is verified, the result is kept with the strokes, so an identical layer isn't
+    decoded again either.
+    The key also covers the parts of the configuration the strokes are generated from, so a
+    cache can be reused after the configuration changed.
+    """
+
+    def __init__(self, maxsize: int = 64):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def key(pattern: np.ndarray | PackedPattern, cfg: Config | None = None) -> bytes:
+        """Returns the cache key of a pattern (hash of its shape and contents), and of the machine
+        dimensions, nozzle configuration and output options of cfg"""
+        data = pattern.words if isinstance(pattern, PackedPattern) else pattern
+        h = hashlib.blake2b(digest_size=16)
+        h.update(repr((type(pattern).__name__, pattern.shape)).encode())
+        if cfg is not None:
+            h.update(repr((dataclasses.astuple(cfg.machine_dimensions), dataclasses.astuple(cfg.nozzle_configuration),
+                           dataclasses.astuple(cfg.output))).encode())
+        h.update(np.ascontiguousarray(data).tobytes())
+        return h.digest()
+
+    def get(self, key: bytes) -> CachedStrokes | None:
+        """Returns the cached entry for key (and marks it as most recently used), or None"""
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: bytes, value: CachedStrokes):
+        """Stores the entry for key, evicting the least recently used entry when the cache is full"""
+        if self.maxsize <= 0:
+            return
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DiskCache:
+    """Persistent cache of rasterized layer patterns, kept in a directory between runs.
+
+    Every layer is stored as a compressed .npz file with the bit-packed pattern and the print
+    head position at the end of the layer. The key is a hash of the layer gcode, the start
+    position and the BedParameters that affect rasterization, so re-running a file only
+    re-parses the layers that changed. The gcode is always emitted from the patterns, so a
+    change in MachineDimensions (e.g. the feedrate) doesn't invalidate the cache.
+    """
+
+    VERSION = 1
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def key(cls, layer_gcode: str | bytes | memoryview, start_pos: GCodeMove, bed_parameters: BedParameters) -> str:
+        """Returns the cache key of a layer"""
+        h = hashlib.blake2b(digest_size=20)
+        h.update(repr((cls.VERSION, bed_parameters.x_size_mm, bed_parameters.y_size_mm, bed_parameters.resolution_mm,
+                       start_pos.X, start_pos.Y, start_pos.Z, start_pos.E)).encode())
+        h.update(layer_gcode.encode() if isinstance(layer_gcode, str) else layer_gcode)
+        return h.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".npz")
+
+    def load(self, key: str) -> tuple[Pattern, GCodeMove] | None:
+        """Returns the cached pattern and end position of a layer, or None when it isn't cached"""
+        try:
+            with np.load(self._path(key)) as data:
+                packed = PackedPattern(tuple(data['shape'].tolist()))
+                packed.words[...] = data['words']
+                end_pos = _array_to_position(data['end'])
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return packed.to_pattern(), end_pos
+
+    def end_position(self, key: str) -> GCodeMove | None:
+        """Returns only the cached end position of a layer (not counted as hit or miss), or None"""
+        try:
+            with np.load(self._path(key)) as data:
+                return _array_to_position(data['end'])
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            return None
+
+    def store(self, key: str, pattern: np.ndarray, end_pos: GCodeMove):
+        """Stores the pattern and end position of a layer
+
+        The file is written under a temporary name and then renamed, so concurrent writers and
+        interrupted runs never leave a partial cache entry.
+        """
+        packed = PackedPattern.from_pattern(pattern)
+        end = np.array([np.nan if v is None else v for v in (end_pos.X, end_pos.Y, end_pos.Z, end_pos.E)], dtype=np.float64)
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, words=packed.words, shape=np.array(packed.shape), end=end)
+        os.replace(tmp_path, path)
+
+def _array_to_position(end: np.ndarray) -> GCodeMove:
+    return GCodeMove(*(None if np.isnan(v) else float(v) for v in end))
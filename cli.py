@@ -0,0 +1,202 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import json
+import logging
+import os
+import time
+from config import Config
+from process import process_gcode_file, JobOptions
+from cache import LayerCache, DiskCache
+from decoder import Verifier
+from progress import format_duration
+from estimator import estimate_program
+from layer_stats import LayerStatistics
+
+logger = logging.getLogger(__name__)
+
+# subcommands of the headless command line, main.py hands over to the CLI when one of these is given
+COMMANDS = ('process', 'watch', 'estimate')
+
+def output_path(gcode_file: str, out_dir: str | None = None) -> str:
+    """Returns the path of the processed gcode for gcode_file, next to it or in out_dir"""
+    output_file = gcode_file.rsplit('.', 1)[0] + '_processed.gcode'
+    if out_dir is not None:
+        output_file = os.path.join(out_dir, os.path.basename(output_file))
+    return output_file
+
+def stats_path(output_file: str) -> str:
+    """Returns the path of the statistics summary written next to a processed gcode file"""
+    return output_file.rsplit('.', 1)[0] + '.stats.json'
+
+def layer_stats_path(output_file: str) -> str:
+    """Returns the path of the per layer statistics written next to a processed gcode file"""
+    return output_file.rsplit('.', 1)[0] + '.layers.json'
+
+def _json_value(value):
+    """Converts a statistics value (numpy scalars included) to a JSON serializable value"""
+    if isinstance(value, (bool, int, float, str)) or value is None:
+        return value
+    try:
+        return value.item()
+    except AttributeError:
+        return str(value)
+
+def process_file(gcode_file: str, cfg: Config, out_dir: str | None = None, cache_size: int = 64,
+                 cache_dir: str | None = None, verify: bool = False, layer_stats: bool = False) -> dict:
+    """Processes a single gcode file and writes its statistics summary next to the output (runs in a worker process)
+
+    With layer_stats, the statistics of every layer are also written next to the output (see layer_stats_path).
+
+    The output is written to a temporary file first and renamed when complete (see
+    process_gcode_file), so a processed file is never seen half written.
+
+    Returns:
+        dict: summary of the job, with the input and output file, the statistics and the error (None on success)
+    """
+    output_file = output_path(gcode_file, out_dir)
+    summary = {'input': gcode_file, 'output': output_file, 'statistics': {}, 'error': None}
+    start_time = time.perf_counter()
+    try:
+        cache = LayerCache(cache_size) if cache_size > 0 else None
+        disk_cache = DiskCache(cache_dir) if cache_dir else None
+        verifier = Verifier(cfg) if verify else None
+        statistics = LayerStatistics(cfg) if layer_stats else None
+        options = JobOptions(cache=cache, disk_cache=disk_cache, verifier=verifier, layer_stats=statistics)
+        stats = process_gcode_file(gcode_file, output_file, cfg, jobs=1, options=options)
+        summary['statistics'] = {key: _json_value(value) for key, value in stats.items()}
+        if statistics is not None:
+            statistics.save(layer_stats_path(output_file))
+        if verifier is not None:
+            summary['verification'] = verifier.mismatches
+    except Exception as e:
+        logger.exception(f"Error processing {gcode_file}")
+        summary['error'] = str(e)
+    summary['statistics']['process time'] = time.perf_counter() - start_time
+
+    with open(stats_path(output_file), 'w') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+def process_files(gcode_files: list[str], cfg: Config, jobs: int = 1, out_dir: str | None = None, cache_size: int = 64,
+                  cache_dir: str | None = None, verify: bool = False, layer_stats: bool = False) -> list[dict]:
+    """Processes gcode files concurrently, one file per worker process
+
+    Returns:
+        list: the summary of every file (see process_file), in the order of gcode_files
+    """
+    if out_dir is not None:
+        os.makedirs(out_dir, exist_ok=True)
+    args = (cfg, out_dir, cache_size, cache_dir, verify, layer_stats)
+    if jobs <= 1 or len(gcode_files) <= 1:
+        return [process_file(gcode_file, *args) for gcode_file in gcode_files]
+    with ProcessPoolExecutor(max_workers=min(jobs, len(gcode_files))) as executor:
+        futures = [executor.submit(process_file, gcode_file, *args) for gcode_file in gcode_files]
+        return [future.result() for future in futures]
+
+def add_processing_arguments(parser: argparse.ArgumentParser):
+    """Adds the options shared by every command that processes gcode, and by the interactive main.py"""
+    parser.add_argument('--cache-size', type=int, default=64,
+                        help="number of distinct layers kept in the layer cache, 0 disables the cache (default: 64)")
+    parser.add_argument('--cache-dir', default=None,
+                        help="directory with rasterized layers of earlier runs, so only changed layers are parsed again")
+    parser.add_argument('--verify', action='store_true',
+                        help="decode the output of every layer again and check it against the rasterized pattern")
+    parser.add_argument('--merge-rows', action='store_true',
+                        help="merge rows with unchanged valve state into one move (same as merge_rows in the config)")
+    parser.add_argument('--trim-strokes', action='store_true',
+                        help="only write the rows between the first and last valve change of every stroke "
+                             "(same as trim_strokes in the config)")
+
+def apply_output_arguments(cfg: Config, args: argparse.Namespace):
+    """Enables the output options given with add_processing_arguments in cfg"""
+    if args.merge_rows:
+        cfg.output.merge_rows = True
+    if args.trim_strokes:
+        cfg.output.trim_strokes = True
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="getafix", description="Postprocessor for gcode files generated by Cura")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    process = commands.add_parser('process', help="process gcode files without user interaction")
+    process.add_argument('files', nargs='+', help="gcode files generated by Cura")
+    process.add_argument('--config', default='machine.toml', help="machine configuration file (default: machine.toml)")
+    process.add_argument('--jobs', type=int, default=os.cpu_count() or 1,
+                         help="number of files processed in parallel (default: number of CPUs)")
+    process.add_argument('--out-dir', default=None,
+                         help="directory the processed files are written to (default: next to the input files)")
+
+    watch = commands.add_parser('watch', help="keep processing the gcode files that land in a folder")
+    watch.add_argument('directory', help="folder to watch for gcode files generated by Cura")
+    watch.add_argument('--config', default='machine.toml', help="machine configuration file (default: machine.toml)")
+    watch.add_argument('--jobs', type=int, default=1, help="number of files processed in parallel (default: 1)")
+    watch.add_argument('--out-dir', default=None,
+                       help="directory the processed files are written to (default: the watched folder)")
+    watch.add_argument('--interval', type=float, default=1.0, help="seconds between two scans of the folder (default: 1)")
+
+    for command in (process, watch):
+        add_processing_arguments(command)
+        command.add_argument('--layer-stats', action='store_true',
+                             help="write the statistics of every layer (nozzle open time, binder volume, ...) "
+                                  "next to the output, as <name>_processed.layers.json")
+
+    estimate = commands.add_parser('estimate', help="estimate the machine time of processed gcode files")
+    estimate.add_argument('files', nargs='+', help="processed gcode files (*_processed.gcode)")
+    estimate.add_argument('--config', default='machine.toml',
+                          help="machine configuration the files were processed with (default: machine.toml)")
+    estimate.add_argument('--feed-rates', type=int, nargs='+', default=[],
+                          help="also estimate the machine time at these y_feed_rate values")
+    estimate.add_argument('--per-layer', action='store_true', help="print the machine time of every layer")
+    return parser
+
+def print_estimate(gcode_file: str, cfg: Config, feed_rates: list[int], per_layer: bool = False):
+    """Prints the estimated machine time of a processed gcode file, at its own and at other feedrates"""
+    with open(gcode_file, 'r') as f:
+        estimate = estimate_program(f, cfg)
+    print(f"{gcode_file}: {len(estimate.layers)} layers, "
+          f"estimated machine time {format_duration(estimate.total())} at F{estimate.y_feed_rate}")
+    if per_layer:
+        for i, layer_time in enumerate(estimate.layer_times()):
+            print(f"  layer {i + 1:>5}: {layer_time:.1f} s")
+    for feed_rate, total in zip(feed_rates, estimate.sweep(feed_rates)):
+        print(f"  at F{feed_rate}: {format_duration(total)}")
+
+def print_summary(summary: dict) -> bool:
+    """Prints a one line result of a processed file, returns False when it failed to process or verify"""
+    if summary['error'] is not None:
+        print(f"FAILED {summary['input']}: {summary['error']}")
+    elif summary.get('verification'):
+        print(f"FAILED {summary['input']}: verification failed for {len(summary['verification'])} layers")
+    else:
+        print(f"OK     {summary['input']} -> {summary['output']} ({summary['statistics']['process time']:.1f} s)")
+        return True
+    return False
+
+def main(argv: list[str] | None = None) -> int:
+    """Runs the headless command line, returns the exit code (1 when a file failed to process or verify)"""
+    args = build_parser().parse_args(argv)
+    config = Config.from_file(args.config)
+    if args.command == 'estimate':
+        for gcode_file in args.files:
+            print_estimate(gcode_file, config, args.feed_rates, args.per_layer)
+        return 0
+
+    apply_output_arguments(config, args)
+
+    if args.command == 'watch':
+        from watch import FolderWatcher # watch imports this module
+        if args.out_dir is not None:
+            os.makedirs(args.out_dir, exist_ok=True)
+        watcher = FolderWatcher(args.directory, config, args.jobs, args.out_dir, args.interval,
+                                args.cache_size, args.cache_dir, args.verify, args.layer_stats)
+        print(f"Watching {args.directory} for gcode files, press Ctrl+C to stop")
+        watcher.run(print_summary)
+        return 0
+
+    summaries = process_files(args.files, config, args.jobs, args.out_dir, args.cache_size, args.cache_dir, args.verify,
+                              args.layer_stats)
+    results = [print_summary(summary) for summary in summaries]
+    return 0 if all(results) else 1
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,6 +1,7 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import tomllib
 import math
+import numpy as np
 
 @dataclass
 class MachineDimensions:
@@ -15,6 +16,7 @@ class NozzleConfiguration:
     total_nozzles: int = 0
     nozzles_per_manifold: int = 0
     number_of_passes: int = 0
+    flow_rate: float = 0.0 # binder flow of one open nozzle in ml/min, for the binder volume statistics
 
 @dataclass
 class BedParameters:
@@ -23,11 +25,33 @@ class BedParameters:
     resolution_mm: int = 5
     deposition_rate: int = 6000
 
+@dataclass
+class OutputOptions:
+    merge_rows: bool = False # merge rows with unchanged valve state into one move
+    trim_strokes: bool = False # only write the rows between the first and last valve change, minimal empty layers
+    travel_feed_rate: int = 0 # with trim_strokes, feedrate of the back stroke through empty margins (0 = y_feed_rate)
+
+@dataclass
+class MacroTimes:
+    """Duration in seconds of the macro commands, for the machine time estimate (see estimator.py)"""
+    homing: float = 0.0 # G28
+    reset_z_platform: float = 0.0
+    z_one_layer: float = 0.0
+    wait_for_machine_ready: float = 0.0
+    fill_hopper_async: float = 0.0 # runs in the background
+    set_first_pass: float = 0.0
+    set_second_pass: float = 0.0
+    valves_set: float = 0.0
+    valves_enable: float = 0.0
+    other: float = 0.0 # any other command that isn't a move or a dwell
+
 @dataclass
 class Config:
     machine_dimensions: MachineDimensions
     nozzle_configuration: NozzleConfiguration
     bed_parameters: BedParameters
+    output: OutputOptions = field(default_factory=OutputOptions)
+    macro_times: MacroTimes = field(default_factory=MacroTimes)
 
     @classmethod
     def from_dict(cls, data: dict) -> 'Config':
@@ -47,15 +71,27 @@ class Config:
             **data.get('bed_parameters', {})
         })
         
+        output = OutputOptions(**{
+            **{f: getattr(OutputOptions(), f) for f in OutputOptions.__annotations__},
+            **data.get('output', {})
+        })
+
+        macro_times = MacroTimes(**{
+            **{f: getattr(MacroTimes(), f) for f in MacroTimes.__annotations__},
+            **data.get('macro_times', {})
+        })
+
         return cls(
             machine_dimensions=machine_dims,
             nozzle_configuration=nozzle_config,
-            bed_parameters=bed_params
+            bed_parameters=bed_params,
+            output=output,
+            macro_times=macro_times
         )
 
     @classmethod
     def from_file(cls, file: str) -> 'Config':
-        with open('machine.toml', 'rb') as f:
+        with open(file, 'rb') as f:
             config_dict = tomllib.load(f)
             return cls.from_dict(config_dict)
         
@@ -68,6 +104,8 @@ class Config:
             return math.floor(coord * self.bed_parameters.resolution_mm)
     
     def machine2pattern_coord(self, coord):
+        if isinstance(coord, np.ndarray):
+            return np.floor(coord / self.bed_parameters.resolution_mm).astype(np.int64)
         if isinstance(coord, tuple):
             x_dim = math.floor(coord[0] / self.bed_parameters.resolution_mm)
             y_dim = math.floor(coord[1] / self.bed_parameters.resolution_mm)
@@ -89,12 +127,30 @@ default_config_empty = {
     'nozzle_configuration': {
         'total_nozzles': None,
         'nozzles_per_manifold': None,
-        'number_of_passes': None
+        'number_of_passes': None,
+        'flow_rate': None
     },
     'bed_parameters': {
         'x_size_mm': None,
         'y_size_mm': None,
         'resolution_mm': None,
         'deposition_rate': None
+    },
+    'output': {
+        'merge_rows': None,
+        'trim_strokes': None,
+        'travel_feed_rate': None
+    },
+    'macro_times': {
+        'homing': None,
+        'reset_z_platform': None,
+        'z_one_layer': None,
+        'wait_for_machine_ready': None,
+        'fill_hopper_async': None,
+        'set_first_pass': None,
+        'set_second_pass': None,
+        'valves_set': None,
+        'valves_enable': None,
+        'other': None
     }
 }
\ No newline at end of file
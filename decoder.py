@@ -0,0 +1,240 @@
+from dataclasses import dataclass
+import mmap
+import os
+import re
+import numpy as np
+from config import Config
+from util import ValveEncoder
+
+_VALVES_SET = np.frombuffer(b"VALVES_SET VALUES=", dtype=np.uint8)
+_MOVE_Y = np.frombuffer(b"G1 Y", dtype=np.uint8)
+_SECOND_PASS = np.frombuffer(b"SET_SECOND_PASS", dtype=np.uint8)
+_LAYER_RE = re.compile(rb'^;Layer(\d+)', re.M)
+_STROKE_RE = re.compile(rb'^G1 Y', re.M)
+
+@dataclass
+class DecodedProgram:
+    """A processed (Asterix) gcode program, decoded back into patterns
+
+    Attributes:
+        patterns: (layers, nozzles, rows) array of 1s and 0s with the valve state of every cell
+        valves_set: (layers, passes, rows) boolean array, True for the rows where a VALVES_SET was emitted
+        headers: per layer a dict with the layer number and the lines of the layer header
+    """
+    patterns: np.ndarray
+    valves_set: np.ndarray
+    headers: list[dict]
+
+def _starts_with(buf: np.ndarray, starts: np.ndarray, prefix: np.ndarray) -> np.ndarray:
+    """Returns for every line start in starts whether the line starts with prefix"""
+    candidates = np.flatnonzero(buf[starts] == prefix[0]) # cheap first filter
+    candidates = candidates[starts[candidates] + len(prefix) <= len(buf)]
+    idx = starts[candidates, np.newaxis] + np.arange(len(prefix))
+    result = np.zeros(len(starts), dtype=bool)
+    result[candidates[(buf[idx] == prefix).all(axis=1)]] = True
+    return result
+
+def _digit_runs(buf: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Returns the start and end of every run of digits in buf, followed by an empty run at the end of buf"""
+    digit = np.concatenate(([False], (buf >= 48) & (buf <= 57), [False]))
+    edges = np.append(np.flatnonzero(digit[1:] != digit[:-1]), [len(buf), len(buf)])
+    return edges[::2], edges[1::2]
+
+def _parse_integers(buf: np.ndarray, starts: np.ndarray, ends: np.ndarray, count: int,
+                    runs: tuple[np.ndarray, np.ndarray] | None = None) -> np.ndarray:
+    """Parses the first `count` integers of every segment buf[starts[i]:ends[i]], as a (segments, count) array
+
+    Any byte that isn't a digit separates two integers. runs are the digit runs of buf (see _digit_runs),
+    pass them when parsing several sets of segments of the same buffer.
+
+    Raises:
+        ValueError: when a segment has fewer than `count` integers
+    """
+    run_starts, run_ends = runs if runs is not None else _digit_runs(buf)
+    # the integers of a segment are the runs from the first one that ends after its start, cut to the segment
+    idx = np.searchsorted(run_ends, starts, side='right')[:, np.newaxis] + np.arange(count)
+    first = np.maximum(run_starts.take(idx, mode='clip'), starts[:, np.newaxis])
+    length = np.minimum(run_ends.take(idx, mode='clip'), ends[:, np.newaxis]) - first
+    found = length > 0
+    if not found.all():
+        raise ValueError(f"found {found.sum(axis=1).min()} integers, expected {count}")
+
+    values = np.zeros(first.shape, dtype=np.int64)
+    for k in range(int(length.max(initial=0))): # digit by digit, over all integers at once
+        values = np.where(length > k, 10 * values + buf.take(first + k, mode='clip') - 48, values)
+    return values
+
+def _valve_commands(gcode: bytes | memoryview, valve_count: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Finds all VALVES_SET commands of a layer, vectorized over all lines
+
+    In processed gcode every VALVES_SET directly follows the move to its row, so only the line
+    before every VALVES_SET is checked; the last move over all lines is only looked up when one
+    doesn't.
+
+    Returns:
+        tuple: the Y of the last move before every VALVES_SET (commands before the first move are
+            left out), its valve bytes as a (commands, valve_count) array, and the pass (0 or 1,
+            after the first SET_SECOND_PASS) it belongs to
+    """
+    buf = np.frombuffer(gcode, dtype=np.uint8)
+    newlines = np.flatnonzero(buf == 10)
+    starts = np.concatenate(([0], newlines + 1))
+    ends = np.concatenate((newlines, [len(buf)]))
+    if starts[-1] == len(buf): # no line after the final newline
+        starts, ends = starts[:-1], ends[:-1]
+    valves = np.flatnonzero(_starts_with(buf, starts, _VALVES_SET))
+    moves = valves - 1
+    if not (_starts_with(buf, starts[moves], _MOVE_Y) & (moves >= 0)).all():
+        # the last move at or before every line
+        line = np.arange(len(starts))
+        last_move = np.maximum.accumulate(np.where(_starts_with(buf, starts, _MOVE_Y), line, -1))
+        moves = last_move[valves]
+        valves, moves = valves[moves >= 0], moves[moves >= 0]
+
+    switch = np.flatnonzero(_starts_with(buf, starts, _SECOND_PASS))
+    second_pass = (valves > switch[0]).astype(np.int64) if len(switch) else np.zeros(len(valves), dtype=np.int64)
+    runs = _digit_runs(buf)
+    y = _parse_integers(buf, starts[moves] + len(_MOVE_Y), ends[moves], 1, runs)[:, 0]
+    words = _parse_integers(buf, starts[valves] + len(_VALVES_SET), ends[valves], valve_count, runs).astype(np.uint8)
+    return y, words, second_pass
+
+def _pass_commands(gcode: str | bytes | memoryview, cfg: Config) -> list[tuple[np.ndarray, np.ndarray]]:
+    """Returns the VALVES_SET commands of both passes of a layer, as (rows, valve bytes) in gcode order"""
+    if isinstance(gcode, str):
+        gcode = gcode.encode()
+    valve_count = ValveEncoder.for_config(cfg).values
+    set_rows, set_words, second_pass = _valve_commands(gcode, valve_count)
+    set_rows = set_rows - cfg.machine_dimensions.y_initial_position - second_pass
+    return [(set_rows[second_pass == p], set_words[second_pass == p]) for p in (0, 1)]
+
+def _held_words(set_rows: np.ndarray, set_words: np.ndarray, rows: np.ndarray, moving_down: bool) -> np.ndarray:
+    """Returns the valve bytes held at every row in rows, given the VALVES_SET commands of a pass"""
+    if not moving_down:
+        # moving up: a row gets the state of the last command at or below it
+        idx = np.searchsorted(set_rows, rows, side='right') - 1
+        held = idx >= 0
+    else:
+        # moving down: a row gets the state of the last command at or above it
+        set_rows, set_words = set_rows[::-1], set_words[::-1]
+        idx = np.searchsorted(set_rows, rows, side='left')
+        held = idx < len(set_rows)
+    words = np.zeros((len(rows), set_words.shape[1]), dtype=np.uint8)
+    words[held] = set_words[idx[held]]
+    return words
+
+def decode_layer_words(gcode: str | bytes | memoryview, cfg: Config) -> tuple[list[np.ndarray], np.ndarray]:
+    """Decodes the processed gcode of a single layer into the valve bytes of every row, for both passes
+
+    The valve state set by a VALVES_SET is held until the next VALVES_SET of the same pass, like on the
+    machine. In the first pass the valves are set for the row at the current Y position, in the second
+    (back) pass for the row below it, matching convert_to_output.
+
+    Args:
+        gcode: processed gcode of one layer
+        cfg: machine configuration the gcode was generated with
+
+    Returns:
+        tuple: (words, valves_set), the valve bytes of both passes as [row, byte] arrays and a
+            (passes, rows) boolean array with the rows where a VALVES_SET was emitted
+    """
+    rows = cfg.get_bed_array_size()[1]
+    words = []
+    valves_set = np.zeros((2, rows), dtype=bool)
+    for p, (set_rows, set_words) in enumerate(_pass_commands(gcode, cfg)):
+        words.append(_held_words(set_rows, set_words, np.arange(rows), moving_down=p == 1))
+        valves_set[p, set_rows[(set_rows >= 0) & (set_rows < rows)]] = True
+    return words, valves_set
+
+def decode_layer(gcode: str | bytes | memoryview, cfg: Config) -> tuple[np.ndarray, np.ndarray]:
+    """Decodes the processed gcode of a single layer back into a pattern, see decode_layer_words
+
+    Returns:
+        tuple: (pattern, valves_set), the decoded pattern as [nozzle, row] array and a (passes, rows)
+            boolean array with the rows where a VALVES_SET was emitted
+    """
+    words, valves_set = decode_layer_words(gcode, cfg)
+    return ValveEncoder.for_config(cfg).decode(words), valves_set
+
+def sampled_rows(rows: int) -> np.ndarray:
+    """Returns a (passes, rows) boolean array with the rows convert_to_output takes the valve state from
+
+    The first pass uses every odd row, the back pass every second row counted from the end.
+    """
+    all_rows = np.arange(rows)
+    return np.stack((all_rows % 2 == 1, (rows - 1 - all_rows) % 2 == 1))
+
+class Verifier:
+    """Round-trip verification of generated gcode, one layer at a time.
+
+    Every layer's gcode is decoded and compared to the pattern it was generated from, on the
+    valve bytes (packed) of the rows the valve state is taken from. Only mismatching layers are
+    unpacked, to report the mismatching cells.
+    """
+
+    def __init__(self, cfg: Config, max_reported_cells: int = 10):
+        self.cfg = cfg
+        self.max_reported_cells = max_reported_cells
+        self.layers_checked = 0
+        self.mismatches = []
+
+    def check_layer(self, layer_idx: int, gcode: str | bytes | memoryview, pattern: np.ndarray) -> bool:
+        """Checks the gcode of a layer against its pattern, returns True when they match
+
+        A mismatch is stored in `mismatches` as a dict with the layer number, the number of
+        mismatching cells and the first (nozzle, row) cells that mismatch.
+        """
+        return self.record(layer_idx, self.mismatching_cells(gcode, pattern))
+
+    def mismatching_cells(self, gcode: str | bytes | memoryview, pattern: np.ndarray) -> list[tuple[int, int]]:
+        """Returns the (nozzle, row) cells where the gcode of a layer doesn't match its pattern, sorted by row"""
+        encoder = ValveEncoder.for_config(self.cfg, pattern.shape[0])
+        expected = encoder.encode(pattern)
+        compared = [np.flatnonzero(r) for r in sampled_rows(self.cfg.get_bed_array_size()[1])]
+        # only the compared rows are decoded
+        errors = [np.bitwise_xor(_held_words(set_rows, set_words, r, moving_down=p == 1), e[r])
+                  for p, ((set_rows, set_words), e, r) in enumerate(zip(_pass_commands(gcode, self.cfg), expected, compared))]
+        if not any(e.any() for e in errors):
+            return []
+
+        cells = []
+        for p, (error, r) in enumerate(zip(errors, compared)):
+            bad_rows, bad_bits = np.nonzero(np.unpackbits(error, axis=1))
+            cells.extend(zip(encoder.index[p, bad_bits].tolist(), r[bad_rows].tolist()))
+        cells.sort(key=lambda cell: (cell[1], cell[0]))
+        return cells
+
+    def record(self, layer_idx: int, cells: list[tuple[int, int]]) -> bool:
+        """Records the result of checking a layer, see mismatching_cells; returns True when it matched"""
+        self.layers_checked += 1
+        if not cells:
+            return True
+        self.mismatches.append({'layer': layer_idx + 1, 'cells': len(cells), 'first cells': cells[:self.max_reported_cells]})
+        return False
+
+def decode_file(gcode_file: str, cfg: Config) -> DecodedProgram:
+    """Decodes a whole processed gcode file into a (layers, nozzles, rows) volume
+
+    Args:
+        gcode_file: path of the processed gcode file
+        cfg: machine configuration the file was generated with
+
+    Returns:
+        DecodedProgram: the decoded patterns of all layers, and the layer headers
+    """
+    columns, rows = cfg.get_bed_array_size()
+    if os.path.getsize(gcode_file) == 0:
+        return DecodedProgram(np.zeros((0, columns, rows), dtype=np.uint8), np.zeros((0, 2, rows), dtype=bool), [])
+
+    with open(gcode_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        markers = list(_LAYER_RE.finditer(mm))
+        patterns = np.zeros((len(markers), columns, rows), dtype=np.uint8)
+        valves_set = np.zeros((len(markers), 2, rows), dtype=bool)
+        headers = []
+        ends = [m.start() for m in markers[1:]] + [len(mm)]
+        for i, (marker, end) in enumerate(zip(markers, ends)):
+            layer = mm[marker.start():end]
+            patterns[i], valves_set[i] = decode_layer(layer, cfg)
+            stroke = _STROKE_RE.search(layer)
+            header = layer[:stroke.start() if stroke else len(layer)].decode()
+            headers.append({'layer': int(marker.group(1)), 'offset': marker.start(), 'lines': header.splitlines()})
+    return DecodedProgram(patterns, valves_set, headers)
@@ -0,0 +1,200 @@
+from dataclasses import dataclass, field, fields
+import math
+from typing import Iterable
+import numpy as np
+from config import Config, MacroTimes
+from process import print_begin_cmd, layer_begin_cmd, layer_return_cmd, layer_end_cmd, print_end_cmd
+
+_MACROS = {f.name.upper(): f.name for f in fields(MacroTimes)}
+_MACROS['G28'] = 'homing'
+
+def combined_feed_rate(y_feed_rate):
+    """Feedrate of the moves where the print head and the hopper move together, like StrokeTemplate
+
+    Works on a single feedrate as well as on an array of feedrates.
+    """
+    if isinstance(y_feed_rate, np.ndarray):
+        return np.trunc(math.sqrt(2) * y_feed_rate)
+    return int(math.sqrt(2) * y_feed_rate)
+
+@dataclass
+class LayerTime:
+    """Machine time of a layer (or of the commands before the first layer), split up so it can be
+    evaluated again at another y_feed_rate without simulating the program again
+
+    Attributes:
+        combined_distance: distance moved at the combined feedrate (see combined_feed_rate), in mm
+        feed_distance: distance moved by the print head at y_feed_rate, in mm
+        other_time: seconds of the moves at any other feedrate (depositing material, travel moves)
+        fixed_time: seconds of the dwells and macro commands
+    """
+    combined_distance: float = 0.0
+    feed_distance: float = 0.0
+    other_time: float = 0.0
+    fixed_time: float = 0.0
+
+    def time(self, y_feed_rate: float) -> float:
+        """Returns the machine time in seconds at y_feed_rate"""
+        return (60 * (self.combined_distance / combined_feed_rate(y_feed_rate) + self.feed_distance / y_feed_rate)
+                + self.other_time + self.fixed_time)
+
+@dataclass
+class TimeEstimate:
+    """Estimated machine time of a program, per layer
+
+    Attributes:
+        y_feed_rate: the y_feed_rate the program was generated with
+        start: the commands before the first layer (homing, ...)
+        layers: the time of every layer, including the layer header
+    """
+    y_feed_rate: int
+    start: LayerTime = field(default_factory=LayerTime)
+    layers: list[LayerTime] = field(default_factory=list)
+
+    def layer_times(self, y_feed_rate: float | None = None) -> np.ndarray:
+        """Returns the machine time in seconds of every layer, at y_feed_rate (default: the one of the program)"""
+        y_feed_rate = y_feed_rate or self.y_feed_rate
+        return np.array([layer.time(y_feed_rate) for layer in self.layers])
+
+    def total(self, y_feed_rate: float | None = None) -> float:
+        """Returns the machine time in seconds of the whole program, at y_feed_rate (default: the one of the program)"""
+        return float(self.sweep([y_feed_rate or self.y_feed_rate])[0])
+
+    def sweep(self, feed_rates: Iterable[float]) -> np.ndarray:
+        """Returns the machine time in seconds of the whole program for every y_feed_rate in feed_rates"""
+        feed_rates = np.asarray(feed_rates, dtype=np.float64)
+        parts = [self.start, *self.layers]
+        combined = sum(part.combined_distance for part in parts)
+        feed = sum(part.feed_distance for part in parts)
+        fixed = sum(part.other_time + part.fixed_time for part in parts)
+        return 60 * (combined / combined_feed_rate(feed_rates) + feed / feed_rates) + fixed
+
+class MachineSimulator:
+    """Simulates the execution of an Asterix program to estimate its machine time
+
+    The moves are timed as distance / feedrate, with the modal feedrate of G0/G1 and the
+    Euclidean distance of the X (hopper) and Y (print head) move, like Klipper plans a combined
+    move. Acceleration isn't modelled, so the estimate is a lower bound. G4 dwells take their
+    P (ms) or S (s) time, and the macro commands take the time in Config.macro_times. Other G
+    and M commands (e.g. G90) take no time.
+    """
+
+    def __init__(self, cfg: Config):
+        self.cfg = cfg
+        self.y_feed_rate = cfg.machine_dimensions.y_feed_rate
+        self.combined_feed_rate = combined_feed_rate(self.y_feed_rate)
+        self.estimate = TimeEstimate(self.y_feed_rate)
+        self.current = self.estimate.start
+        self.x = 0.0
+        self.y = 0.0
+        self.f = float(self.y_feed_rate)
+
+    def begin_layer(self):
+        self.current = LayerTime()
+        self.estimate.layers.append(self.current)
+
+    def move(self, x: float, y: float, f: float):
+        """Moves to (x, y) at feedrate f"""
+        distance = math.hypot(x - self.x, y - self.y)
+        if y != self.y and f == self.combined_feed_rate:
+            self.current.combined_distance += distance
+        elif y != self.y and f == self.y_feed_rate:
+            self.current.feed_distance += distance
+        elif distance:
+            self.current.other_time += 60 * distance / f
+        self.x, self.y, self.f = x, y, f
+
+    def moves(self, x: np.ndarray, y: np.ndarray, f: np.ndarray):
+        """Moves through all points (x[i], y[i]) at feedrate f[i], same as calling move for every point"""
+        if not len(x):
+            return
+        distance = np.hypot(np.diff(x, prepend=self.x), np.diff(y, prepend=self.y))
+        moving_y = np.diff(y, prepend=self.y) != 0
+        combined = moving_y & (f == self.combined_feed_rate)
+        feed = moving_y & (f == self.y_feed_rate)
+        other = ~combined & ~feed
+        self.current.combined_distance += float(distance[combined].sum())
+        self.current.feed_distance += float(distance[feed].sum())
+        self.current.other_time += float((60 * distance[other] / f[other]).sum())
+        self.x, self.y, self.f = float(x[-1]), float(y[-1]), float(f[-1])
+
+    def run(self, lines: Iterable[str]):
+        """Simulates the commands in lines, a line starting with ;Layer starts a new layer"""
+        macro_times = self.cfg.macro_times
+        for line in lines:
+            if line.startswith(';Layer'):
+                self.begin_layer()
+                continue
+            words = line.split(';', 1)[0].split()
+            if not words:
+                continue
+            command = words[0]
+            if command in ('G0', 'G1'):
+                params = {word[0]: float(word[1:]) for word in words[1:]}
+                self.move(params.get('X', self.x), params.get('Y', self.y), params.get('F', self.f))
+            elif command == 'G4':
+                params = {word[0]: float(word[1:]) for word in words[1:]}
+                self.current.fixed_time += params.get('P', 0.0) / 1000 + params.get('S', 0.0)
+            elif command in _MACROS:
+                self.current.fixed_time += getattr(macro_times, _MACROS[command])
+                if command == 'G28':
+                    axes = [word for word in words[1:] if word in ('X', 'Y')] or ['X', 'Y']
+                    self.x = 0.0 if 'X' in axes else self.x
+                    self.y = 0.0 if 'Y' in axes else self.y
+            elif command[0] not in 'GM' or not command[1:].isdigit():
+                self.current.fixed_time += macro_times.other
+
+def estimate_program(lines: Iterable[str], cfg: Config) -> TimeEstimate:
+    """Estimates the machine time of a processed (Asterix) gcode program, per layer
+
+    Args:
+        lines: the lines of the program, e.g. an open file
+        cfg: the machine configuration the program was generated with
+
+    Returns:
+        TimeEstimate: the time of the program, which can also be evaluated at other feedrates
+    """
+    simulator = MachineSimulator(cfg)
+    simulator.run(lines)
+    return simulator.estimate
+
+def estimate_job(cfg: Config, layer_count: int, rows: int | None = None) -> TimeEstimate:
+    """Estimates the machine time of a job with layer_count layers, without generating the program
+
+    The strokes are computed from the machine dimensions like StrokeTemplate, but as arrays of
+    positions instead of gcode lines; only the short command sequences around the strokes are
+    simulated as text. The result is the same as estimate_program on the output of process_gcode
+    with the default output options. The valve state doesn't change the time of the strokes, only
+    the number of VALVES_SET commands, so with merge_rows or trim_strokes the estimate is an
+    upper bound.
+
+    Args:
+        cfg: machine configuration
+        layer_count: number of layers of the job
+        rows: number of pattern rows (default: the rows of the print bed)
+    """
+    dims = cfg.machine_dimensions
+    rows = cfg.get_bed_array_size()[1] if rows is None else rows
+    simulator = MachineSimulator(cfg)
+    simulator.run(print_begin_cmd(layer_count).splitlines())
+
+    y = dims.y_initial_position + np.arange(rows, dtype=np.float64)
+    x = dims.x_maximum_position - y
+    forward_f = np.where(x < 0, dims.y_feed_rate, simulator.combined_feed_rate).astype(np.float64)
+    forward_x = np.maximum(x, 0)
+    y_end = dims.y_initial_position + rows
+    back_y = np.arange(y_end, dims.y_initial_position, -1, dtype=np.float64)
+
+    for layer_idx in range(min(layer_count, 2)): # only the start position of the first layer differs
+        simulator.run(layer_begin_cmd(layer_idx, dims.x_maximum_position, cfg.bed_parameters.deposition_rate).splitlines())
+        simulator.moves(forward_x, y, forward_f)
+        simulator.run(layer_return_cmd(y_end, dims.y_feed_rate).splitlines())
+        simulator.moves(np.full(rows, simulator.x), back_y, np.full(rows, simulator.f))
+        simulator.run(layer_end_cmd(dims.y_initial_position).splitlines())
+        # the slots of both passes, the VALVES_SET commands around the strokes are in the command text
+        simulator.current.fixed_time += 2 * (rows // 2) * cfg.macro_times.valves_set
+    simulator.run(print_end_cmd(layer_count).splitlines())
+
+    layers = simulator.estimate.layers
+    layers.extend(LayerTime(**vars(layers[-1])) for _ in range(layer_count - len(layers)))
+    return simulator.estimate
@@ -1,5 +1,15 @@
 import math
-from typing import Optional
+import re
+from typing import Iterator, Optional
+import numpy as np
+
+# lines with a G0 or G1 command (same check as GCodeMove.fromstring), and their X/Y/Z/E parameters
+_MOVE_LINE_RE = re.compile(r'^G[01].*$', re.M)
+_PARAM_RE = re.compile(r'(?<!\S)([XYZE])(\S*)')
+_MOVE_LINE_RE_BYTES = re.compile(rb'^G[01].*$', re.M)
+_PARAM_RE_BYTES = re.compile(rb'(?<!\S)([XYZE])(\S*)')
+_AXIS_INDEX = {'X': 0, 'Y': 1, 'Z': 2, 'E': 3, b'X': 0, b'Y': 1, b'Z': 2, b'E': 3}
+_NO_PARAMETERS = [None, None, None, None]
 
 class GCodeMove:
     """A class representing a G-code movement command (G0 or G1).
@@ -7,6 +17,7 @@ class GCodeMove:
     This class handles parsing and storing G-code movement commands with X, Y, Z, and E parameters.
     It supports both travel moves (G0) and extrusion moves (G1).
     """
+    __slots__ = ('X', 'Y', 'Z', 'E', 'extrusion_move')
 
     def __init__(self, x: float = None, y: float = None, z: float = None, e: float = None, extrusion_move: bool = False):
         """Initialize a GCodeMove with optional X, Y, Z and E coordinates.
@@ -78,4 +89,105 @@ class GCodeMove:
         if (move.Z):
             self.Z = move.Z
         if (move.E):
-            self.E = move.Z
\ No newline at end of file
+            self.E = move.Z
+
+def scan_moves(gcode: str | bytes | memoryview) -> Iterator[tuple[bool, Optional[float], Optional[float], Optional[float], Optional[float]]]:
+    """Scan a block of gcode (e.g. a whole layer) for G0/G1 moves in a single pass.
+
+    Non-move lines are skipped by the regular expression, so no exceptions are raised for
+    comments, M-codes, etc. Lines are accepted and parsed like GCodeMove.fromstring does.
+    The gcode can also be given as bytes (e.g. a memoryview of a memory-mapped file), in which
+    case it is scanned without decoding it.
+
+    Args:
+        gcode (str | bytes | memoryview): gcode text, may contain many lines
+
+    Yields:
+        tuple: (extrusion_move, x, y, z, e) for every move, parameters that are not given are None
+    """
+    if isinstance(gcode, str):
+        move_re, param_re, g1 = _MOVE_LINE_RE, _PARAM_RE, '1'
+    else:
+        move_re, param_re, g1 = _MOVE_LINE_RE_BYTES, _PARAM_RE_BYTES, b'1'
+    for line in move_re.findall(gcode):
+        params = [None, None, None, None]
+        try:
+            for axis, value in param_re.findall(line):
+                params[_AXIS_INDEX[axis]] = float(value)
+        except ValueError:
+            continue # malformed parameter, GCodeMove.fromstring rejects these lines as well
+        if params == _NO_PARAMETERS:
+            continue
+        yield line[1:2] == g1, params[0], params[1], params[2], params[3]
+
+def _carry_forward(values: np.ndarray, start: float) -> np.ndarray:
+    """Returns the position along one axis before every move.
+
+    Follows the GCodeMove.update rules: a missing (NaN) or zero coordinate keeps the current position.
+    """
+    valid = ~np.isnan(values) & (values != 0)
+    last_valid = np.where(valid, np.arange(len(values)), -1)
+    np.maximum.accumulate(last_valid, out=last_valid)
+    after = np.where(last_valid >= 0, values[last_valid], start)
+    return np.concatenate(([start], after))[:-1]
+
+class MoveBuffer:
+    """Columnar representation of a sequence of G0/G1 moves (e.g. a whole layer), backed by numpy arrays.
+
+    Every move is one entry in the X, Y, Z, E (float) and is_extrude (bool) columns. Parameters
+    that are not given in the gcode are stored as NaN. Downstream stages can work on the columns
+    directly, instead of on one GCodeMove object per line.
+    """
+    __slots__ = ('X', 'Y', 'Z', 'E', 'is_extrude')
+
+    def __init__(self, x: np.ndarray, y: np.ndarray, z: np.ndarray, e: np.ndarray, is_extrude: np.ndarray):
+        self.X = x
+        self.Y = y
+        self.Z = z
+        self.E = e
+        self.is_extrude = is_extrude
+
+    @classmethod
+    def from_gcode(cls, gcode: str | bytes | memoryview) -> 'MoveBuffer':
+        """Create a MoveBuffer with all the moves in a block of gcode
+
+        Args:
+            gcode (str | bytes | memoryview): gcode text, may contain many lines
+
+        Returns:
+            MoveBuffer: New instance with one entry per move
+        """
+        moves = np.array(list(scan_moves(gcode)), dtype=np.float64).reshape(-1, 5)
+        return cls(moves[:, 1], moves[:, 2], moves[:, 3], moves[:, 4], moves[:, 0] != 0)
+
+    def __len__(self) -> int:
+        return len(self.is_extrude)
+
+    def resolve(self, start: GCodeMove) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Resolve the begin and end coordinates of every move in the XY plane.
+
+        Missing coordinates of a move are taken from the current position, and the current position
+        is updated like GCodeMove.update does.
+
+        Args:
+            start (GCodeMove): position of the print head before the first move
+
+        Returns:
+            tuple: arrays (begin_x, begin_y, end_x, end_y), one entry per move
+        """
+        begin_x = _carry_forward(self.X, start.X)
+        begin_y = _carry_forward(self.Y, start.Y)
+        end_x = np.where(np.isnan(self.X), begin_x, self.X)
+        end_y = np.where(np.isnan(self.Y), begin_y, self.Y)
+        return begin_x, begin_y, end_x, end_y
+
+    def update_position(self, position: GCodeMove):
+        """Update position in place, as if GCodeMove.update was called for every move in the buffer"""
+        for axis, values in (('X', self.X), ('Y', self.Y), ('Z', self.Z)):
+            updates = np.flatnonzero(~np.isnan(values) & (values != 0))
+            if len(updates):
+                setattr(position, axis, float(values[updates[-1]]))
+        extrusions = np.flatnonzero(~np.isnan(self.E) & (self.E != 0))
+        if len(extrusions):
+            z = self.Z[extrusions[-1]]
+            position.E = None if np.isnan(z) else float(z)
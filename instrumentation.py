@@ -0,0 +1,126 @@
+from contextlib import contextmanager, nullcontext
+import csv
+import json
+import sys
+import time
+import tracemalloc
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+STAGES = ('parse', 'rasterize', 'encode', 'emit')
+
+class Instrumentation:
+    """Records the wall time of every processing stage per layer, and the memory use of a job.
+
+    Stages can be nested, the time of a stage excludes the time of the stages inside it (e.g.
+    'encode' runs inside 'emit'). Time of a layer that isn't in any stage (e.g. loading a
+    layer from the disk cache) is counted as 'other'.
+
+    Attributes:
+        layers: per layer a dict with the layer number, the time per stage, the total time and
+            the input and output size
+        trace_memory: record the tracemalloc high-water mark (slows down processing considerably)
+    """
+
+    def __init__(self, trace_memory: bool = False):
+        self.trace_memory = trace_memory
+        self.layers = []
+        self._layer = None
+        self._layer_start = None
+        self._stack = []
+        self._job_start = None
+        self.job_time = 0.0
+        self.tracemalloc_peak = None
+
+    def start(self):
+        """Starts timing the job"""
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            tracemalloc.reset_peak()
+        self._job_start = time.perf_counter()
+
+    def stop(self):
+        """Stops timing the job"""
+        self.job_time = time.perf_counter() - self._job_start
+        if self.trace_memory and tracemalloc.is_tracing():
+            self.tracemalloc_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    def begin_layer(self, layer_idx: int, input_bytes: int = 0):
+        """Starts timing a layer, input_bytes is the size of the layer's gcode"""
+        self._layer = {'layer': layer_idx + 1, **{stage: 0.0 for stage in STAGES}, 'other': 0.0, 'total': 0.0,
+                       'input bytes': input_bytes, 'output bytes': 0, 'output lines': 0}
+        self._layer_start = time.perf_counter()
+
+    def end_layer(self, output: str = ""):
+        """Finishes the current layer, output is the gcode written for the layer"""
+        layer = self._layer
+        layer['total'] = time.perf_counter() - self._layer_start
+        layer['other'] = max(0.0, layer['total'] - sum(layer[stage] for stage in STAGES))
+        layer['output bytes'] = len(output)
+        layer['output lines'] = output.count('\n')
+        self.layers.append(layer)
+        self._layer = None
+        return layer
+
+    @contextmanager
+    def stage(self, name: str):
+        """Context manager that adds the time spent inside it to stage `name` of the current layer"""
+        start = time.perf_counter()
+        self._stack.append(0.0) # time spent in nested stages
+        try:
+            yield
+        finally:
+            nested = self._stack.pop()
+            elapsed = time.perf_counter() - start
+            if self._layer is not None:
+                self._layer[name] += elapsed - nested
+            if self._stack:
+                self._stack[-1] += elapsed
+
+    def statistics(self) -> dict:
+        """Returns the totals of the job, as entries for the statistics of process_gcode"""
+        stats = {f"{stage} time": sum(layer[stage] for layer in self.layers) for stage in STAGES}
+        stats['other time'] = sum(layer['other'] for layer in self.layers)
+        stats['job time'] = self.job_time
+        if self.layers:
+            slowest = max(self.layers, key=lambda layer: layer['total'])
+            stats['slowest layer'] = f"{slowest['layer']} ({slowest['total']:.3f} s)"
+        if self.job_time > 0:
+            stats['input bytes/sec'] = sum(layer['input bytes'] for layer in self.layers) / self.job_time
+            stats['output bytes/sec'] = sum(layer['output bytes'] for layer in self.layers) / self.job_time
+            stats['output lines/sec'] = sum(layer['output lines'] for layer in self.layers) / self.job_time
+        rss = peak_rss()
+        if rss is not None:
+            stats['peak RSS (MB)'] = rss / 2**20
+        if self.tracemalloc_peak is not None:
+            stats['tracemalloc peak (MB)'] = self.tracemalloc_peak / 2**20
+        return stats
+
+    def save(self, path: str):
+        """Saves the per layer timings, as CSV when path ends with .csv and as JSON (with the totals) otherwise"""
+        if path.endswith('.csv'):
+            with open(path, 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=['layer', *STAGES, 'other', 'total', 'input bytes', 'output bytes',
+                                                       'output lines'])
+                writer.writeheader()
+                writer.writerows(self.layers)
+        else:
+            with open(path, 'w') as f:
+                json.dump({'totals': self.statistics(), 'layers': self.layers}, f, indent=2)
+
+def peak_rss() -> int | None:
+    """Returns the peak resident set size in bytes of the largest of this process and its worker processes,
+    None when unknown"""
+    if resource is None:
+        return None
+    unit = 1 if sys.platform == 'darwin' else 1024 # ru_maxrss is in bytes on macOS, in kilobytes on Linux
+    return unit * max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+def measure(instrumentation: Instrumentation | None, stage: str):
+    """Returns the context manager timing `stage`, or one that does nothing when instrumentation is None"""
+    if instrumentation is None:
+        return nullcontext()
+    return instrumentation.stage(stage)
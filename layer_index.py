@@ -0,0 +1,63 @@
+import json
+import os
+
+class LayerIndex:
+    """Sidecar index of a processed gcode file, for random access to its layers.
+
+    For every layer it stores the byte offset and length of the layer in the processed file,
+    together with per-layer statistics. The index is saved as a small json file next to the
+    processed gcode, so tools can seek directly to a layer instead of scanning the file.
+    """
+
+    def __init__(self, layers: list[dict] | None = None, file_size: int | None = None):
+        self.layers = layers if layers is not None else []
+        self.file_size = file_size
+
+    @staticmethod
+    def index_path(gcode_path: str) -> str:
+        """Returns the path of the sidecar index belonging to a processed gcode file"""
+        return f"{gcode_path}.index.json"
+
+    def add(self, layer_number: int, offset: int, length: int, **stats):
+        """Adds a layer (layer_number as in the ;Layer{n} comment of the processed file)"""
+        self.layers.append({'layer': layer_number, 'offset': offset, 'length': length, **stats})
+
+    def get(self, layer_number: int) -> dict:
+        """Returns the index entry of a layer
+
+        Raises:
+            KeyError: If the layer is not in the index
+        """
+        # layers are added in order, so the entry is normally found at its position directly
+        pos = layer_number - self.layers[0]['layer'] if self.layers else -1
+        if 0 <= pos < len(self.layers) and self.layers[pos]['layer'] == layer_number:
+            return self.layers[pos]
+        for entry in self.layers:
+            if entry['layer'] == layer_number:
+                return entry
+        raise KeyError(f"Layer {layer_number} is not in the index")
+
+    def is_valid_for(self, gcode_path: str) -> bool:
+        """Checks that the index belongs to the current version of the processed file"""
+        return self.file_size is not None and os.path.getsize(gcode_path) == self.file_size
+
+    def read_layer(self, gcode_path: str, layer_number: int) -> str:
+        """Reads the gcode of a single layer from the processed file, by seeking to its offset
+
+        The offsets are byte offsets, so the file is read in binary mode; \r\n line endings (a file
+        written in text mode on Windows) are converted to \n, as when reading the file as text.
+        """
+        entry = self.get(layer_number)
+        with open(gcode_path, 'rb') as f:
+            f.seek(entry['offset'])
+            return f.read(entry['length']).decode().replace('\r\n', '\n')
+
+    def save(self, path: str):
+        with open(path, 'w') as f:
+            json.dump({'file_size': self.file_size, 'layers': self.layers}, f)
+
+    @classmethod
+    def load(cls, path: str) -> 'LayerIndex':
+        with open(path, 'r') as f:
+            data = json.load(f)
+        return cls(data['layers'], data.get('file_size'))
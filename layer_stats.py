@@ -0,0 +1,129 @@
+import csv
+import json
+import numpy as np
+from config import Config
+from pattern import PackedPattern
+
+class LayerStatistics:
+    """Collects per layer statistics of the printed patterns, for binder and nozzle wear planning.
+
+    Every layer is measured in a single pass over its pattern: the open cells are counted per
+    pattern column and per pattern row, everything else follows from these two counts. A
+    pattern column is printed by nozzle column // number_of_passes (the head shifts between the
+    passes), and the nozzles are grouped into manifolds of nozzles_per_manifold. A valve is open
+    for 60 / y_feed_rate seconds per open cell (one row is 1 mm of print head travel), and while
+    open a nozzle deposits NozzleConfiguration.flow_rate ml/min of binder.
+
+    Attributes:
+        bins: number of bins of the fill histogram of every layer; the histogram counts the
+            rows by the fraction of their cells that is printed, rows with nothing to print are
+            in the first bin
+        layers: per layer a dict with the layer number, fill, open cells, open time, binder
+            volume, active area, bounding box (in pattern columns and rows) and fill histogram
+        nozzle_open_time: seconds every nozzle was open, summed over all layers
+    """
+
+    def __init__(self, cfg: Config, bins: int = 10):
+        self.cfg = cfg
+        self.bins = bins
+        nozzles = cfg.nozzle_configuration
+        self.passes = nozzles.number_of_passes or 2
+        self.nozzles_per_manifold = nozzles.nozzles_per_manifold or 8
+        self.row_time = 60 / cfg.machine_dimensions.y_feed_rate
+        self.layers = []
+        self.nozzle_open_time = np.zeros(0)
+
+    def measure(self, layer_idx: int, pattern: np.ndarray) -> tuple[dict, np.ndarray]:
+        """Measures a single layer, without adding it to the statistics (see add)
+
+        Args:
+            layer_idx: index of the layer
+            pattern: the pattern of the layer, indexed as [nozzle, row], or a PackedPattern
+
+        Returns:
+            tuple: the statistics of the layer, and the open time of every nozzle in seconds
+        """
+        columns, rows = pattern.shape
+        if isinstance(pattern, PackedPattern):
+            bits_per_pass = np.unpackbits(pattern.words, axis=2).sum(axis=1, dtype=np.int64)
+            column_cells = np.zeros(columns, dtype=np.int64)
+            for p in range(len(bits_per_pass)):
+                count = len(column_cells[p::2])
+                column_cells[p::2] = bits_per_pass[p, :count]
+            row_cells = np.bitwise_count(pattern.words).sum(axis=(0, 2), dtype=np.int64)
+        else:
+            column_cells = np.count_nonzero(pattern, axis=1)
+            row_cells = np.count_nonzero(pattern, axis=0)
+
+        nozzle_open_time = np.bincount(np.arange(columns) // self.passes, weights=column_cells) * self.row_time
+        open_cells = int(column_cells.sum())
+        open_time = open_cells * self.row_time
+        active_columns = np.flatnonzero(column_cells)
+        active_rows = np.flatnonzero(row_cells)
+        histogram, _ = np.histogram(row_cells / columns, bins=self.bins, range=(0, 1))
+        resolution = self.cfg.bed_parameters.resolution_mm
+        empty = not len(active_rows)
+        layer = {
+            'layer': layer_idx + 1,
+            'fill (%)': 100 * open_cells / (columns * rows),
+            'open cells': open_cells,
+            'open time (s)': open_time,
+            'binder volume (ml)': open_time * self.cfg.nozzle_configuration.flow_rate / 60,
+            'active area (mm2)': open_cells * resolution,
+            'column min': None if empty else int(active_columns[0]),
+            'column max': None if empty else int(active_columns[-1]),
+            'row min': None if empty else int(active_rows[0]),
+            'row max': None if empty else int(active_rows[-1]),
+            'fill histogram': histogram.tolist(),
+        }
+        return layer, nozzle_open_time
+
+    def add(self, layer: dict, nozzle_open_time: np.ndarray):
+        """Adds a layer measured with measure (e.g. in a worker process)"""
+        if len(nozzle_open_time) > len(self.nozzle_open_time):
+            self.nozzle_open_time = np.pad(self.nozzle_open_time, (0, len(nozzle_open_time) - len(self.nozzle_open_time)))
+        self.nozzle_open_time[:len(nozzle_open_time)] += nozzle_open_time
+        self.layers.append(layer)
+
+    def add_layer(self, layer_idx: int, pattern: np.ndarray) -> dict:
+        """Measures a layer and adds it to the statistics"""
+        layer, nozzle_open_time = self.measure(layer_idx, pattern)
+        self.add(layer, nozzle_open_time)
+        return layer
+
+    def manifold_open_time(self) -> np.ndarray:
+        """Returns the seconds the nozzles of every manifold were open, summed over the nozzles and layers"""
+        manifolds = np.arange(len(self.nozzle_open_time)) // self.nozzles_per_manifold
+        return np.bincount(manifolds, weights=self.nozzle_open_time)
+
+    def statistics(self) -> dict:
+        """Returns the totals of the job, as entries for the statistics of process_gcode"""
+        stats = {
+            'binder volume (ml)': sum(layer['binder volume (ml)'] for layer in self.layers),
+            'active area (mm2)': sum(layer['active area (mm2)'] for layer in self.layers),
+            'empty layers': sum(layer['open cells'] == 0 for layer in self.layers),
+        }
+        if len(self.nozzle_open_time):
+            stats['nozzle open time max (s)'] = float(self.nozzle_open_time.max())
+            stats['nozzle open time mean (s)'] = float(self.nozzle_open_time.mean())
+            stats['busiest nozzle'] = int(self.nozzle_open_time.argmax())
+        return stats
+
+    def save(self, path: str):
+        """Saves the per layer statistics, as CSV when path ends with .csv and as JSON (with the totals
+        and the open time of every nozzle and manifold) otherwise"""
+        layers = sorted(self.layers, key=lambda layer: layer['layer'])
+        if path.endswith('.csv'):
+            fields = [key for key in layers[0] if key != 'fill histogram'] if layers else []
+            bin_names = [f"fill {100 * i / self.bins:.0f}-{100 * (i + 1) / self.bins:.0f}%" for i in range(self.bins)]
+            with open(path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(fields + bin_names)
+                for layer in layers:
+                    writer.writerow([layer[key] for key in fields] + layer['fill histogram'])
+        else:
+            with open(path, 'w') as f:
+                json.dump({'totals': self.statistics(),
+                           'nozzle open time (s)': self.nozzle_open_time.tolist(),
+                           'manifold open time (s)': self.manifold_open_time().tolist(),
+                           'layers': layers}, f, indent=2)
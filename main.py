@@ -1,7 +1,14 @@
-import tkinter as tk
-from tkinter import filedialog
+import argparse
+import multiprocessing
+import sys
 from config import Config
-from process import process_gcode
+from process import process_gcode_file, JobOptions
+from cache import LayerCache, DiskCache
+from decoder import Verifier
+from instrumentation import Instrumentation
+from progress import ProgressReporter
+from layer_stats import LayerStatistics
+import cli
 import logging
 
 VERSION = "1.0.0"
@@ -9,6 +16,20 @@ VERSION = "1.0.0"
 def main():
     print(f"Getafix version: {VERSION}")
     print(f"Postprocessor for gcode files generated by Cura, to be changed into code for the Asterix 1.0")
+
+    parser = argparse.ArgumentParser(description="Postprocessor for gcode files generated by Cura")
+    parser.add_argument('--jobs', type=int, default=1,
+                        help="number of worker processes used to process layers in parallel (default: 1)")
+    cli.add_processing_arguments(parser)
+    parser.add_argument('--profile', action='store_true',
+                        help="record the time spent in every stage of every layer, and the memory use")
+    parser.add_argument('--profile-memory', action='store_true',
+                        help="with --profile, also record the tracemalloc high-water mark (slow)")
+    parser.add_argument('--profile-output', default=None,
+                        help="with --profile, save the timings of every layer to this .json or .csv file")
+    parser.add_argument('--layer-stats', default=None,
+                        help="save the statistics of every layer (nozzle open time, binder volume, ...) to this .json or .csv file")
+    args = parser.parse_args()
     
     logger = logging.getLogger(__name__)
     logname = "log.log"
@@ -17,6 +38,10 @@ def main():
                     format='%(asctime)s,%(msecs)03d %(name)s %(levelname)s %(message)s',
                     datefmt='%Y-%m-%d %H:%M:%S',
                     level=logging.INFO)
+    # tkinter is only needed for the file dialog, so the headless CLI doesn't pay for importing it
+    import tkinter as tk
+    from tkinter import filedialog
+
     # Create root window and hide it
     root = tk.Tk()
     root.withdraw()
@@ -31,6 +56,7 @@ def main():
         try:
             # Load machine config
             config = Config.from_file('machine.toml')
+            cli.apply_output_arguments(config, args)
 
             # Print current feedrate and ask for confirmation
             print(f"Feedrate is set to: {config.machine_dimensions.y_feed_rate}")
@@ -43,19 +69,32 @@ def main():
             import time
             start_time = time.time()
 
-            # Read gcode file
-            with open(gcode_file, 'r') as f:
-                input_gcode = f.read()
+            cache = LayerCache(args.cache_size) if args.cache_size > 0 else None
+            disk_cache = DiskCache(args.cache_dir) if args.cache_dir else None
+            verifier = Verifier(config) if args.verify else None
+            instrumentation = Instrumentation(args.profile_memory) if args.profile else None
+            layer_stats = LayerStatistics(config) if args.layer_stats else None
 
-            # Process the gcode
-            output = process_gcode(input_gcode, config)
-            
-            # Write output to file
+            # Process the gcode layer by layer, writing the output as we go
             output_file = gcode_file.rsplit('.', 1)[0] + '_processed.gcode'
-            with open(output_file, 'w') as f:
-                f.write(output['gcode'])
+            options = JobOptions(cache=cache, disk_cache=disk_cache, verifier=verifier, instrumentation=instrumentation,
+                                 progress=ProgressReporter(), layer_stats=layer_stats)
+            output = {'statistics': process_gcode_file(gcode_file, output_file, config, jobs=args.jobs, options=options)}
 
             print(f"Processing complete. Output written to: {output_file}")
+            if instrumentation is not None and args.profile_output:
+                instrumentation.save(args.profile_output)
+                print(f"Layer timings written to: {args.profile_output}")
+            if layer_stats is not None:
+                layer_stats.save(args.layer_stats)
+                print(f"Layer statistics written to: {args.layer_stats}")
+            if verifier is not None:
+                if verifier.mismatches:
+                    print(f"Verification FAILED for {len(verifier.mismatches)} of {verifier.layers_checked} layers:")
+                    for mismatch in verifier.mismatches:
+                        print(f"  layer {mismatch['layer']}: {mismatch['cells']} cells differ, first (nozzle, row): {mismatch['first cells']}")
+                else:
+                    print(f"Verification passed for all {verifier.layers_checked} layers")
 
             # Stop timer and calculate duration
             end_time = time.time()
@@ -80,4 +119,7 @@ def main():
     input("Press enter to exit")
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support() # needed for worker processes in the pyinstaller executable
+    if sys.argv[1:2] and sys.argv[1] in cli.COMMANDS:
+        sys.exit(cli.main())
     main()
@@ -9,7 +9,8 @@ class Pattern(np.ndarray[np.uint8]):
     def __new__(cls, size: tuple[int, int]):
         # Create a new zero-filled array
         obj = np.zeros(size, dtype=np.uint8).view(cls)
-        logger.debug("Initialized Pattern!")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Initialized Pattern!")
         return obj
 
     def __array_finalize__(self, obj):
@@ -18,8 +19,8 @@ class Pattern(np.ndarray[np.uint8]):
 
     def add_line(self, column: int, start_row: int, end_row: int):
         """Changes part of the pattern to ones following the column and start and end row provided"""
-        
-        logger.debug(f"adding line to pattern [{column},{start_row}:{end_row}]")
+        if logger.isEnabledFor(logging.DEBUG): # no formatting on the hot path unless debugging
+            logger.debug(f"adding line to pattern [{column},{start_row}:{end_row}]")
         if (start_row < 0 or end_row >= self.shape[1] or 
             column < 0 or column >= self.shape[0]):
             logger.warning(
@@ -27,6 +28,31 @@ class Pattern(np.ndarray[np.uint8]):
                 f"{start_row}:{end_row}], size: {self.shape}"
             )
         self[column, start_row:end_row] = 1
+
+    def add_lines(self, columns: np.ndarray, start_rows: np.ndarray, end_rows: np.ndarray):
+        """Changes part of the pattern to ones for many lines at once, same as calling add_line for every line
+
+        The lines are marked with a difference array: +1 at the start row and -1 at the end row
+        of every line, after which a cumulative sum along the rows gives the covered cells.
+        """
+        columns = np.asarray(columns, dtype=np.int64)
+        start_rows = np.asarray(start_rows, dtype=np.int64)
+        end_rows = np.asarray(end_rows, dtype=np.int64)
+
+        in_bounds = ((start_rows >= 0) & (end_rows < self.shape[1]) &
+                     (columns >= 0) & (columns < self.shape[0]))
+        for column, start_row, end_row in zip(columns[~in_bounds], start_rows[~in_bounds], end_rows[~in_bounds]):
+            self.add_line(column, start_row, end_row)
+
+        keep = in_bounds & (start_rows < end_rows)
+        if not keep.any():
+            return
+        row_stride = self.shape[1] + 1
+        size = self.shape[0] * row_stride
+        diff = (np.bincount(columns[keep] * row_stride + start_rows[keep], minlength=size) -
+                np.bincount(columns[keep] * row_stride + end_rows[keep], minlength=size))
+        covered = np.cumsum(diff.reshape(self.shape[0], row_stride)[:, :-1], axis=1) > 0
+        self[covered] = 1
     
     def clear(self):
         """Resets the pattern to all zeros"""
@@ -38,4 +64,75 @@ class Pattern(np.ndarray[np.uint8]):
     
     def get_number_of_rows(self):
         """Returns the number of rows in the pattern"""
-        return self.shape[1]
\ No newline at end of file
+        return self.shape[1]
+
+class PackedPattern:
+    """A bit-packed printing pattern, storing 1 bit per cell.
+
+    The nozzles (columns) are split into the two passes, even nozzles for the first pass and
+    odd nozzles for the second pass, and packed into bytes along the nozzle axis, first nozzle
+    in the most significant bit. The words are stored as [pass, row, byte], so the valve bytes
+    of a row can be read directly without any bit shuffling.
+    """
+
+    def __init__(self, size: tuple[int, int]):
+        self.shape = size
+        nozzles_per_pass = (size[0] + 1) // 2
+        self.words = np.zeros((2, size[1], (nozzles_per_pass + 7) // 8), dtype=np.uint8)
+
+    @classmethod
+    def from_pattern(cls, pattern: np.ndarray) -> 'PackedPattern':
+        """Create a PackedPattern from an (unpacked) Pattern"""
+        packed = cls(pattern.shape)
+        bits = np.zeros((pattern.shape[0] + pattern.shape[0] % 2, pattern.shape[1]), dtype=bool)
+        bits[:pattern.shape[0]] = pattern
+        packed.words[0] = np.packbits(bits[::2].T, axis=1)
+        packed.words[1] = np.packbits(bits[1::2].T, axis=1)
+        return packed
+
+    def to_pattern(self) -> Pattern:
+        """Returns the unpacked Pattern"""
+        pattern = Pattern(self.shape)
+        pattern[::2] = np.unpackbits(self.words[0], axis=1, count=len(pattern[::2])).T
+        pattern[1::2] = np.unpackbits(self.words[1], axis=1, count=len(pattern[1::2])).T
+        return pattern
+
+    def add_line(self, column: int, start_row: int, end_row: int):
+        """Changes part of the pattern to ones following the column and start and end row provided"""
+        if (start_row < 0 or end_row >= self.shape[1] or 
+            column < 0 or column >= self.shape[0]):
+            logger.warning(
+                f"Attempt to set pattern out of bounds (requested [{column},"
+                f"{start_row}:{end_row}], size: {self.shape}"
+            )
+            if column < 0 or column >= self.shape[0]:
+                raise IndexError(f"column {column} is out of bounds for pattern with size {self.shape}")
+            start_row = max(start_row, 0)
+        nozzle = column // 2
+        self.words[column % 2, start_row:end_row, nozzle // 8] |= np.uint8(0x80 >> (nozzle % 8))
+
+    def clear(self):
+        """Resets the pattern to all zeros"""
+        self.words.fill(0)
+
+    def count_nonzero(self) -> int:
+        """Returns the number of ones in the pattern (popcount of the packed words)"""
+        return int(np.bitwise_count(self.words).sum())
+
+    def fill_percentage(self) -> float:
+        """Returns the percentage of ones in the pattern (0-100)"""
+        return self.count_nonzero() / (self.shape[0] * self.shape[1]) * 100
+
+    def valve_bytes(self, second_pass: bool = False) -> np.ndarray[np.uint8]:
+        """Returns the valve bytes of the even (first pass) or odd (second pass) nozzles, indexed as [row, byte]"""
+        if (self.shape[0] // 2) % 8 or ((self.shape[0] + 1) // 2) % 8:
+            raise ValueError(f"number of nozzles per pass must be multiple of 8 (pattern has {self.shape[0]} nozzles)")
+        return self.words[1 if second_pass else 0]
+
+    def get_number_of_columns(self):
+        """Returns the number of columns in the pattern"""
+        return self.shape[0]
+    
+    def get_number_of_rows(self):
+        """Returns the number of rows in the pattern"""
+        return self.shape[1]
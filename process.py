@@ -1,31 +1,97 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import dataclasses
+import io
 import logging
-from gcode import GCodeMove
+import mmap
+import os
+from gcode import GCodeMove, MoveBuffer, scan_moves
 import math
-from pattern import Pattern
+from pattern import Pattern, PackedPattern
 import re
+from typing import Iterable, Iterator, TextIO
 import numpy as np
-from util import list_of_bits_to_list_of_int
+from util import list_of_bits_to_list_of_int, active_row_range, ValveEncoder
 from config import Config
+from cache import LayerCache, DiskCache, CachedStrokes
+from layer_index import LayerIndex
+from decoder import Verifier
+from instrumentation import Instrumentation, measure
+from progress import ProgressCallback
+from layer_stats import LayerStatistics
 
 logger = logging.getLogger(__name__)
 
-def print_begin_cmd(number_of_layers: int) -> str:
-    return (
+LAYER_COUNT_RE = re.compile(r';LAYER_COUNT:(\d+)')
+LAYER_COUNT_RE_BYTES = re.compile(rb';LAYER_COUNT:(\d+)')
+LAYER_MARKER_RE_BYTES = re.compile(rb'^;LAYER:', re.M)
+
+# size hint for the output of a single pattern row (G1 + VALVES_SET line, both strokes)
+EXPECTED_LEN_ONE_ENTRY = 71
+
+class ChunkSink(list):
+    """Output sink that collects written text as a list of chunks.
+
+    Any object with a write(str) method (an open file, io.StringIO, ...) can be used as
+    output sink; this one keeps the chunks in memory without concatenating them.
+    """
+    size = 0
+
+    def write(self, text: str) -> int:
+        self.append(text)
+        self.size += len(text)
+        return len(text)
+
+    def tell(self) -> int:
+        return self.size
+
+    def getvalue(self) -> str:
+        return "".join(self)
+
+class LineCountingSink:
+    """Output sink wrapper that counts the lines written through it"""
+
+    def __init__(self, out: TextIO):
+        self.out = out
+        self.lines = 0
+
+    def write(self, text: str) -> int:
+        self.lines += text.count("\n")
+        return self.out.write(text)
+
+    def tell(self) -> int:
+        return self.out.tell()
+
+def _emit(text: str, out: TextIO | None) -> str | None:
+    """Writes text to the output sink, or returns it when no sink is given"""
+    if out is None:
+        return text
+    out.write(text)
+
+# number of VALVES_SET values of the Asterix 1.0: 88 nozzles in manifolds of 8
+DEFAULT_VALVE_COUNT = 11
+
+def valves_closed_cmd(valve_count: int = DEFAULT_VALVE_COUNT) -> str:
+    """Returns the VALVES_SET command that closes all valves"""
+    return "VALVES_SET VALUES=" + ",".join(["0"] * valve_count) + "\n"
+
+def print_begin_cmd(number_of_layers: int, out: TextIO | None = None, valve_count: int = DEFAULT_VALVE_COUNT) -> str | None:
+    return _emit((
         f"SET_PRINT_STATS_INFO TOTAL_LAYER={number_of_layers}\n"
         "G90\n"
         "G28 X Y\n"
         "SET_FIRST_PASS\n"
         "RESET_Z_PLATFORM\n"
         "G4 P1500  ; wait for servo\n"
-        "VALVES_SET VALUES=0,0,0,0,0,0,0,0,0,0,0\n"
+        f"{valves_closed_cmd(valve_count)}"
         "VALVES_ENABLE ; change to VALVES_DISABLE to do run without valves active\n\n"
-    )
+    ), out)
 
-def print_end_cmd(number_of_layers: int) -> str:
-    return f"; total layers count = {number_of_layers}\n"
+def print_end_cmd(number_of_layers: int, out: TextIO | None = None) -> str | None:
+    return _emit(f"; total layers count = {number_of_layers}\n", out)
 
-def layer_begin_cmd(layer_idx: int, x_maximum_position: int, deposition_rate: int) -> str:
-    return (
+def layer_begin_cmd(layer_idx: int, x_maximum_position: int, deposition_rate: int, out: TextIO | None = None) -> str | None:
+    return _emit((
         f";Layer{layer_idx+1}\n"
         f"SET_PRINT_STATS_INFO CURRENT_LAYER={layer_idx+1}\n"
         f"RESPOND MSG=\"Start layer {layer_idx+1}\"\n"
@@ -34,9 +100,10 @@ def layer_begin_cmd(layer_idx: int, x_maximum_position: int, deposition_rate: in
         "Z_ONE_LAYER\n"
         "WAIT_FOR_MACHINE_READY\n"
         f"G1 X{x_maximum_position} F{deposition_rate}; deposit material\n"
-    )
+    ), out)
 
-def layer_return_cmd(y_return_position: int, y_feed_rate: int) -> str:
+def layer_return_cmd(y_return_position: int, y_feed_rate: int, out: TextIO | None = None,
+                     valve_count: int = DEFAULT_VALVE_COUNT) -> str | None:
     """Generate the GCode commands for returning the print head to a specified Y position.
 
     This command sequence moves the print head to the end y position, disables all valves,
@@ -45,192 +112,869 @@ def layer_return_cmd(y_return_position: int, y_feed_rate: int) -> str:
 
     Args:
         y_return_position (int): The Y coordinate to return the print head to
+        out (TextIO, optional): output sink to write the commands to
+        valve_count (int, optional): number of VALVES_SET values (see ValveEncoder)
 
     Returns:
-        str: GCode command sequence for the return movement
+        str: GCode command sequence for the return movement, or None when written to `out`
     """
-    return (
+    return _emit((
         f"G1 Y{y_return_position} F{y_feed_rate}\n"
-        "VALVES_SET VALUES=0,0,0,0,0,0,0,0,0,0,0\n"
+        f"{valves_closed_cmd(valve_count)}"
         f"G1 Y{y_return_position+1}\n"
         "FILL_HOPPER_ASYNC\n"
         "SET_SECOND_PASS\n"
         "G4 P3000\n"
-    )
+    ), out)
 
-def layer_end_cmd(y_start_bed_pos: int) -> str:
-    return (
+def layer_end_cmd(y_start_bed_pos: int, out: TextIO | None = None, valve_count: int = DEFAULT_VALVE_COUNT) -> str | None:
+    return _emit((
         f"G1 Y{y_start_bed_pos}\n"
-        "VALVES_SET VALUES=0,0,0,0,0,0,0,0,0,0,0\n"
+        f"{valves_closed_cmd(valve_count)}"
         "G1 Y0\n"
-    )
+    ), out)
+
+def rasterize_moves(moves: MoveBuffer, pattern: Pattern, config: Config, current_pos: GCodeMove):
+    """Marks all vertical G1 moves in the pattern, in one vectorized step
+
+    Columns are computed with machine2pattern_coord on the whole array, and all lines are
+    added with a single Pattern.add_lines call. current_pos is updated to the position of the
+    print head after the last move.
+    """
+    begin_x, begin_y, end_x, end_y = moves.resolve(current_pos)
+
+    tolerance = 1e-8
+    g1_moves = moves.is_extrude
+    x_mismatch = g1_moves & (np.abs(end_x - begin_x) > tolerance)
+    if x_mismatch.any():
+        def optional(value):
+            return None if np.isnan(value) else float(value)
+        # the E of the print head before every move is the Z of the last extrusion, see GCodeMove.update
+        extrusions = np.flatnonzero(~np.isnan(moves.E) & (moves.E != 0))
+        for i in np.flatnonzero(x_mismatch):
+            previous = extrusions[extrusions < i]
+            begin_e = optional(moves.Z[previous[-1]]) if len(previous) else current_pos.E
+            logger.warning(f"Begin and end coordinates do not have the same X-value (current: {(float(begin_x[i]), float(begin_y[i]), begin_e)}, "
+                           f"target: {(float(end_x[i]), float(end_y[i]), optional(moves.E[i]))})")
+
+    lines = g1_moves & ~x_mismatch & (end_y != begin_y)
+    downwards = end_y[lines] <= begin_y[lines]
+    columns = config.machine2pattern_coord(np.where(downwards, end_x[lines], begin_x[lines]))
+    start_rows = np.trunc(np.minimum(begin_y[lines], end_y[lines]))
+    end_rows = np.trunc(np.maximum(begin_y[lines], end_y[lines]))
+    pattern.add_lines(columns, start_rows, end_rows)
+
+    moves.update_position(current_pos)
 
 # a function that converts a G-code and extracts the coordinates of the matrix object
 # the current_pos will contain the ending posision of the print head, so this can be used for the 
 # next iteration
-def convert_gcode_to_pattern(gcode: str, config: Config, current_pos: GCodeMove = GCodeMove(0,0,0,0)) -> Pattern:
+def convert_gcode_to_pattern(gcode: str, config: Config, current_pos: GCodeMove = GCodeMove(0,0,0,0),
+                             instrumentation: Instrumentation | None = None) -> Pattern:
     ps = (config.machine2pattern_coord(config.bed_parameters.x_size_mm),config.bed_parameters.y_size_mm)
-    pattern = Pattern(ps)
-
-    for line in iter(gcode.splitlines()):
-        try:
-            target_pos = GCodeMove.fromstring(line)
-        except ValueError:
-            continue
-        if target_pos.X is None: target_pos.X = current_pos.X
-        if target_pos.Y is None: target_pos.Y = current_pos.Y
-
-        if target_pos.is_G1_command():
-            tolerance = 1e-8
-            if abs(target_pos.X - current_pos.X) > tolerance:
-                logger.warning(f"Begin and end coordinates do not have the same X-value (current: {(current_pos.X, current_pos.Y, current_pos.E)}, target: {(target_pos.X, target_pos.Y, target_pos.E)})")
-            elif abs(target_pos.Y - current_pos.Y) > 0:
-                begin, end = (target_pos, current_pos) if target_pos.Y <= current_pos.Y else (current_pos, target_pos)
-                pattern.add_line(config.machine2pattern_coord(begin.X), int(begin.Y), int(end.Y))
-        current_pos.update(target_pos)
-
-
+    with measure(instrumentation, 'parse'):
+        moves = MoveBuffer.from_gcode(gcode)
+    with measure(instrumentation, 'rasterize'):
+        pattern = Pattern(ps)
+        rasterize_moves(moves, pattern, config, current_pos)
     return pattern
     
+def format_valve_row(values: np.ndarray[np.uint8]) -> str:
+    """Format one row of precomputed valve bytes as a VALVES_SET command"""
+    return "VALVES_SET VALUES=" + ",".join(map(str, values.tolist())) + "\n"
+
+def format_valve_rows(values: np.ndarray[np.uint8]) -> list[str]:
+    """Format rows of precomputed valve bytes ([row, byte] array) as VALVES_SET commands
+
+    Every distinct row is formatted only once, most layers have many identical (e.g. empty) rows.
+    """
+    if len(values) == 0:
+        return []
+    # every row as a bytes object; numpy strips the trailing zero bytes, which is fine for rows of equal length
+    width = values.shape[1]
+    keys = np.ascontiguousarray(values, dtype=np.uint8).view(f'S{width}').ravel().tolist()
+    lines = {key: format_valve_row(np.frombuffer(key.ljust(width, b'\0'), dtype=np.uint8)) for key in set(keys)}
+    return [lines[key] for key in keys]
+
 def convert_pattern_row_to_gcode(row: list[int]) -> str:
-    if any(val > 0 for val in row):
-        pass # just for debugging
-    values = list_of_bits_to_list_of_int(row)
-    output = "VALVES_SET VALUES="
-    for v in values:
-        output += f"{v},"
-    return output[:-1] + '\n'
+    return format_valve_row(list_of_bits_to_list_of_int(row))
 
 
-def convert_to_output(pattern: Pattern, layer: int, config: Config) -> str:
+def check_pattern_size(pattern: Pattern, config: Config):
+    """Raises a ValueError when the pattern doesn't fit on the print bed"""
+    if pattern.get_number_of_rows() > (config.machine_dimensions.y_maximum_position - config.machine_dimensions.y_initial_position):
+        raise ValueError("The pattern contains more entries than the size of print bed allows")
+
+def convert_to_output(pattern: Pattern, layer: int, config: Config, out: TextIO | None = None,
+                      instrumentation: Instrumentation | None = None) -> str | None:
     """ takes in a pattern, and returns Asterix gcode 
     
     note that X is the position of the hopper, and Y is the position of the print head.
     The hopper moves oppostie to the print head
+
+    When an output sink `out` is given, the gcode is written to it directly and None is returned
     """
-    if pattern.get_number_of_rows() > (config.machine_dimensions.y_maximum_position - config.machine_dimensions.y_initial_position):
-        raise ValueError("The pattern contains more entries than the size of print bed allows")
+    if out is None:
+        out = ChunkSink()
+        convert_to_output(pattern, layer, config, out, instrumentation)
+        return out.getvalue()
 
-    EXPECTED_LEN_ONE_ENTRY = 71
-    n = pattern.get_number_of_rows() * EXPECTED_LEN_ONE_ENTRY + 1
-    output = layer_begin_cmd(layer, config.machine_dimensions.x_maximum_position, config.bed_parameters.deposition_rate)
-    
-    #when two axes move together, klipper sees this as a diagonal move, and we need to increase
-    # the feed rate by sqrt(2) to maintain desired velocity of each axis separately
-    v_combined = int(math.sqrt(2)*config.machine_dimensions.y_feed_rate)
-    #v_combined = 8460 #temporary to force the value to be same as the output we want to compare it with for the test
-    y_dest = config.machine_dimensions.y_initial_position
-    x_dest = config.machine_dimensions.x_maximum_position - y_dest
-
-    feedrate = v_combined
-    #first stroke, x-axis moves 'down'wards, y-axis upwards
-
-    set_valves = True
-    for i, row in enumerate(pattern.T):
-        output += f"G1 Y{y_dest} X{x_dest} F{feedrate}\n"
-
-        if set_valves==True:
-            set_valves = False
-        else:
-            set_valves = True
-            #output += convert_pattern_row_to_gcode(extract_every_second_bit(row, True))
-            output += convert_pattern_row_to_gcode(row[::2])
-        # update destination position
-        y_dest += 1
-        x_dest = config.machine_dimensions.x_maximum_position - y_dest
-        if x_dest < 0: # hopper arrived in home position
-            x_dest = 0
-            feedrate = config.machine_dimensions.y_feed_rate
-        if y_dest > config.machine_dimensions.y_maximum_position:
-            raise IndexError("Number of rows in pattern exceeds size of the print bed")
-    
-    # reached end of stroke
-    output += layer_return_cmd(y_dest, config.machine_dimensions.y_feed_rate)
-    set_valves = True
-    #back stroke    
-    for row in pattern.T[::-1]:
-        feedrate = config.machine_dimensions.y_feed_rate
-        output += f"G1 Y{y_dest}\n"
-
-        if set_valves==True:
-            set_valves = False
+    check_pattern_size(pattern, config)
+    layer_begin_cmd(layer, config.machine_dimensions.x_maximum_position, config.bed_parameters.deposition_rate, out)
+    convert_pattern_to_strokes(pattern, config, out, instrumentation)
+
+def convert_pattern_to_strokes(pattern: Pattern, config: Config, out: TextIO | None = None,
+                               instrumentation: Instrumentation | None = None) -> str | None:
+    """Returns the gcode of both strokes of a layer, i.e. everything after the layer_begin_cmd
+
+    This part doesn't depend on the layer index, so it can be reused for identical layers.
+    When an output sink `out` is given, the gcode is written to it directly and None is returned
+    """
+    if out is None:
+        out = ChunkSink()
+        convert_pattern_to_strokes(pattern, config, out, instrumentation)
+        return out.getvalue()
+
+    check_pattern_size(pattern, config)
+    encoder = ValveEncoder.for_config(config, pattern.get_number_of_columns())
+    if encoder.passes != 2:
+        raise ValueError(f"only 2 passes can be written (forward and back stroke), configured: {encoder.passes}")
+    template = StrokeTemplate.for_config(config, pattern.get_number_of_rows(), encoder.values)
+    options = config.output
+    with measure(instrumentation, 'encode'):
+        if options.trim_strokes and not isinstance(pattern, PackedPattern):
+            # only encode the rows between the first and last row with anything to print
+            start, stop = active_row_range(pattern)
+            if start == stop:
+                template.render_empty(out, options.travel_feed_rate)
+                return
+            first_pass, second_pass = np.zeros((2, pattern.get_number_of_rows(), encoder.values), dtype=np.uint8)
+            first_pass[start:stop], second_pass[start:stop] = encoder.encode(pattern[:, start:stop])
         else:
-            set_valves = True
-            #output += convert_pattern_row_to_gcode(extract_every_second_bit(row, False))
-            output += convert_pattern_row_to_gcode(row[1::2])
-    
-        # update destination position
-        y_dest -= 1
+            first_pass, second_pass = encoder.encode(pattern)
+    if options.merge_rows or options.trim_strokes:
+        template.render_compact(first_pass, second_pass, out, options.merge_rows, options.trim_strokes,
+                                options.travel_feed_rate)
+    else:
+        template.render(first_pass, second_pass, out)
 
-        if y_dest < config.machine_dimensions.y_initial_position:
-            raise IndexError("Print head past initial position while pattern is not yet finished")        
-    
-    output += layer_end_cmd(config.machine_dimensions.y_initial_position)
-    return output
+class StrokeTemplate:
+    """The gcode of both strokes of a layer with open slots for the VALVES_SET lines
+
+    Apart from the valve bytes, the strokes only depend on the machine dimensions and the number
+    of pattern rows: the G1 moves of the print head and the hopper, the hopper clamping at its
+    home position, the feedrate switch and the return and end commands. A template holds this
+    text preformatted, as the segments between the VALVES_SET lines, and for every slot the row
+    of the pass the valve state is taken from. Templates are built once per machine dimensions
+    and row count, see for_config.
+
+    Attributes:
+        segments: the text before, between and after the VALVES_SET lines (one more than slots)
+        line_count: number of lines written by render
+        rows: per pass, the pattern rows of the slots in order of output; all slots of the first
+            pass come before those of the second pass
+        moves: per pass, the G1 line of every pattern row
+        breakpoints: per pass, the rows that can't be merged with their neighbours (see render_compact)
+    """
+    _templates = {}
+
+    def __init__(self, config: Config, rows: int, valve_count: int = DEFAULT_VALVE_COUNT):
+        dims = config.machine_dimensions
+        forward = []
+        hopper = [] # (X, F) of every forward move
+        slot_rows = ([], [])
+
+        #when two axes move together, klipper sees this as a diagonal move, and we need to increase
+        # the feed rate by sqrt(2) to maintain desired velocity of each axis separately
+        v_combined = int(math.sqrt(2)*dims.y_feed_rate)
+        y_dest = dims.y_initial_position
+        x_dest = dims.x_maximum_position - y_dest
+
+        feedrate = v_combined
+        #first stroke, x-axis moves 'down'wards, y-axis upwards
+        set_valves = True
+        for i in range(rows):
+            forward.append(f"G1 Y{y_dest} X{x_dest} F{feedrate}\n")
+            hopper.append((x_dest, feedrate))
+
+            if set_valves==True:
+                set_valves = False
+            else:
+                set_valves = True
+                slot_rows[0].append(i)
+            # update destination position
+            y_dest += 1
+            x_dest = dims.x_maximum_position - y_dest
+            if x_dest < 0: # hopper arrived in home position
+                x_dest = 0
+                feedrate = dims.y_feed_rate
+            if y_dest > dims.y_maximum_position:
+                raise IndexError("Number of rows in pattern exceeds size of the print bed")
+
+        # reached end of stroke
+        return_cmd = layer_return_cmd(y_dest, dims.y_feed_rate, valve_count=valve_count)
+        back = [None] * rows
+        set_valves = True
+        #back stroke
+        for i in reversed(range(rows)):
+            back[i] = f"G1 Y{y_dest}\n"
+
+            if set_valves==True:
+                set_valves = False
+            else:
+                set_valves = True
+                slot_rows[1].append(i)
+
+            # update destination position
+            y_dest -= 1
+
+            if y_dest < dims.y_initial_position:
+                raise IndexError("Print head past initial position while pattern is not yet finished")
+
+        end_cmd = layer_end_cmd(dims.y_initial_position, valve_count=valve_count)
+
+        # the text between the slots
+        segments = []
+        parts = []
+        for p, moves, order in ((0, forward, range(rows)), (1, back, reversed(range(rows)))):
+            slots = set(slot_rows[p])
+            for i in order:
+                parts.append(moves[i])
+                if i in slots:
+                    segments.append("".join(parts))
+                    parts = []
+            parts.append(return_cmd if p == 0 else end_cmd)
+        segments.append("".join(parts))
+
+        # a forward move can only be merged with the next one when the hopper moves in the same
+        # direction at the same feedrate, i.e. not where the hopper arrives in its home position
+        breakpoints = [i for i in range(1, rows - 1)
+                       if (hopper[i+1][0] - hopper[i][0], hopper[i+1][1]) != (hopper[i][0] - hopper[i-1][0], hopper[i][1])]
+        self.segments = segments
+        self.rows = tuple(np.array(r, dtype=np.intp) for r in slot_rows)
+        self.moves = (forward, back)
+        self.breakpoints = (np.array(sorted({0, rows - 1, *breakpoints}) if rows else [], dtype=np.intp),
+                            np.array([0] if rows else [], dtype=np.intp))
+        self.return_cmd = return_cmd
+        self.end_cmd = end_cmd
+        self.y_feed_rate = dims.y_feed_rate
+        self.line_count = sum(segment.count("\n") for segment in segments) + len(slot_rows[0]) + len(slot_rows[1])
+
+    @classmethod
+    def for_config(cls, config: Config, rows: int, valve_count: int = DEFAULT_VALVE_COUNT) -> 'StrokeTemplate':
+        """Returns the template for the machine dimensions of config, the number of rows and the number of
+        VALVES_SET values, building it on first use"""
+        key = (dataclasses.astuple(config.machine_dimensions), rows, valve_count)
+        template = cls._templates.get(key)
+        if template is None:
+            template = cls._templates[key] = cls(config, rows, valve_count)
+        return template
+
+    def render(self, first_pass: np.ndarray[np.uint8], second_pass: np.ndarray[np.uint8], out: TextIO):
+        """Writes the strokes to out, with the valve bytes of both passes ([row, byte] arrays, see ValveEncoder)"""
+        lines = format_valve_rows(first_pass[self.rows[0]]) + format_valve_rows(second_pass[self.rows[1]])
+        parts = [None] * (len(self.segments) + len(lines))
+        parts[::2] = self.segments
+        parts[1::2] = lines
+        out.write("".join(parts))
+
+    def render_compact(self, first_pass: np.ndarray[np.uint8], second_pass: np.ndarray[np.uint8], out: TextIO,
+                       merge: bool = True, trim: bool = False, travel_feed_rate: int = 0):
+        """Same as render, but leaves out the moves and VALVES_SET commands that don't change the valves
+
+        The valves are closed at the start of both strokes. With merge, only the VALVES_SET
+        commands that change the valve state are written, with the move to their row, so rows
+        with an unchanged valve state become a single move. With trim (and without merge), every
+        row is written from the first to the last change of the valve state of a stroke, the
+        empty margins before and after become a single move. In both cases the breakpoints are
+        always kept: the first and last move of the first stroke, the move where the hopper
+        arrives in its home position (its direction and feedrate change there) and the last
+        move of the back stroke. The valves switch at the same positions as with render, so the
+        deposited pattern is the same, and the hopper follows the print head as before.
+
+        With trim, a layer without any valve changes is written as a minimal sequence (see
+        render_empty), and with travel_feed_rate the back stroke travels through its empty
+        margins (valves closed) at that feedrate.
+        """
+        changes = []
+        for p, valve_bytes in enumerate((first_pass, second_pass)):
+            rows = self.rows[p]
+            words = valve_bytes[rows]
+            previous = np.vstack((np.zeros_like(words[:1]), words[:-1]))
+            changes.append(np.flatnonzero(np.any(words != previous, axis=1))) # index in rows
+        if trim and not any(len(c) for c in changes):
+            self.render_empty(out, travel_feed_rate)
+            return
+
+        parts = []
+        for p, valve_bytes in enumerate((first_pass, second_pass)):
+            rows, change = self.rows[p], changes[p]
+            if merge:
+                valve_rows = rows[change]
+                kept = np.union1d(valve_rows, self.breakpoints[p])
+            elif len(change):
+                valve_rows = rows[change[0]:change[-1] + 1]
+                window = np.arange(min(valve_rows[0], valve_rows[-1]), max(valve_rows[0], valve_rows[-1]) + 1)
+                kept = np.union1d(window, self.breakpoints[p])
+            else:
+                valve_rows = rows[:0]
+                kept = self.breakpoints[p]
+            valves = dict(zip(valve_rows.tolist(), format_valve_rows(valve_bytes[valve_rows])))
+            moves = [self.moves[p][i] for i in (kept.tolist() if p == 0 else kept[::-1].tolist())]
+            kept_rows = kept.tolist() if p == 0 else kept[::-1].tolist()
+
+            travel = p == 1 and trim and travel_feed_rate > 0
+            if travel and len(change):
+                # travel to the first change, and from the last change on when it closed the valves
+                first = kept_rows.index(rows[change[0]])
+                moves[first] = moves[first][:-1] + f" F{travel_feed_rate}\n"
+                if first + 1 < len(moves):
+                    moves[first + 1] = moves[first + 1][:-1] + f" F{self.y_feed_rate}\n"
+                last = kept_rows.index(rows[change[-1]])
+                if not valve_bytes[rows[change[-1]]].any() and last + 1 < len(moves):
+                    moves[last + 1] = moves[last + 1][:-1] + f" F{travel_feed_rate}\n"
+            for i, move in zip(kept_rows, moves):
+                parts.append(move)
+                if i in valves:
+                    parts.append(valves[i])
+            parts.append(self.return_cmd if p == 0 else self.end_cmd)
+        out.write("".join(parts))
+
+    def render_empty(self, out: TextIO, travel_feed_rate: int = 0):
+        """Writes the minimal strokes of a layer without anything to print
+
+        Only the breakpoint moves of the first stroke are written, so the hopper still deposits
+        the layer, followed by the hopper refill and the move back to the start. The back stroke
+        and the switch to the second pass are left out.
+        """
+        parts = [self.moves[0][i] for i in self.breakpoints[0].tolist()]
+        parts.append("FILL_HOPPER_ASYNC\n")
+        # the last forward move may have been at the combined feedrate, so the move back always sets F
+        first_line, rest = self.end_cmd.split("\n", 1)
+        parts.append(f"{first_line} F{travel_feed_rate if travel_feed_rate > 0 else self.y_feed_rate}\n{rest}")
+        out.write("".join(parts))
 
 def calculate_fill_percentage(pattern: Pattern) -> float:
     """
     Calculate the percentage of non-zero values in a 2D numpy array.
     
     Args:
-        pattern: 2D numpy array
+        pattern: 2D numpy array, or a PackedPattern
         
     Returns:
         float: Percentage of non-zero values (0-100)
     """
+    if isinstance(pattern, PackedPattern):
+        return pattern.fill_percentage()
     total_elements = pattern.size
     non_zero_elements = np.count_nonzero(pattern)
     return (non_zero_elements / total_elements) * 100
 
 
-def process_gcode(gcode: str, cfg: Config):
+def scan_end_position(gcode: str | bytes, current_pos: GCodeMove) -> GCodeMove:
+    """Cheap pre-scan of a layer that returns the print head position at the end of the layer.
+
+    This gives the same position convert_gcode_to_pattern leaves in current_pos, without
+    rasterizing the layer, so the next layer can be processed independently. Only the end of the
+    layer is parsed: the lines are scanned backwards until the last X, Y and E updates are found,
+    and the last Z update is found by searching backwards for a Z parameter.
+
+    Args:
+        gcode: gcode of a single layer
+        current_pos: position of the print head at the start of the layer (not modified)
+
+    Returns:
+        GCodeMove: position of the print head at the end of the layer
+    """
+    def updates(value):
+        # same rule as GCodeMove.update: a missing (or NaN) or zero coordinate keeps the current position
+        return value is not None and value != 0 and not math.isnan(value)
+
+    end_pos = GCodeMove(current_pos.X, current_pos.Y, current_pos.Z, current_pos.E)
+    newline, space, tab, z = ('\n', ' ', '\t', 'Z') if isinstance(gcode, str) else (b'\n', b' ', b'\t', b'Z')
+
+    # Cura only moves Z at the start of a layer, so the Z parameters are found with a (fast) text search
+    end = len(gcode)
+    while end > 0:
+        found = max(gcode.rfind(space + z, 0, end), gcode.rfind(tab + z, 0, end))
+        if found < 0:
+            break
+        start = gcode.rfind(newline, 0, found) + 1
+        line_end = gcode.find(newline, found)
+        moves = list(scan_moves(gcode[start:line_end if line_end >= 0 else len(gcode)]))
+        if moves and updates(moves[0][3]):
+            end_pos.Z = moves[0][3]
+            break
+        end = found
+
+    x_found = y_found = e_found = False
+    end = len(gcode)
+    while end > 0 and not (x_found and y_found and e_found):
+        start = gcode.rfind(newline, 0, end) + 1
+        for _, x, y, z, e in scan_moves(gcode[start:end]):
+            if not x_found and updates(x):
+                end_pos.X, x_found = x, True
+            if not y_found and updates(y):
+                end_pos.Y, y_found = y, True
+            if not e_found and updates(e):
+                # GCodeMove.update copies Z into E
+                end_pos.E, e_found = z if z is not None and not math.isnan(z) else None, True
+        end = start - 1
+    return end_pos
+
+@dataclasses.dataclass
+class JobOptions:
+    """Optional collaborators of a processing job (see process_layers); all of them are off by default
+
+    Attributes:
+        cache: cache to reuse the gcode of identical layers
+        disk_cache: persistent cache with the patterns of layers processed in earlier runs
+        index: layer index, the offset and length of every layer in the output is added to it
+            (requires an output sink with a tell() method)
+        verifier: Verifier, the output of every layer is decoded and checked against its pattern
+        instrumentation: Instrumentation, records the time of every stage of every layer; its
+            totals are added to the statistics
+        progress: progress callback, see progress.ProgressCallback
+        layer_stats: LayerStatistics, measures the pattern of every layer; its totals are
+            added to the statistics
+    """
+    cache: LayerCache | None = None
+    disk_cache: DiskCache | None = None
+    index: LayerIndex | None = None
+    verifier: Verifier | None = None
+    instrumentation: Instrumentation | None = None
+    progress: ProgressCallback | None = None
+    layer_stats: LayerStatistics | None = None
+
+def load_or_convert_pattern(layer_block: str, cfg: Config, current_pos: GCodeMove, disk_cache: DiskCache | None = None,
+                            instrumentation: Instrumentation | None = None) -> Pattern:
+    """Same as convert_gcode_to_pattern, but loads the pattern and end position from the disk cache
+    when the layer was processed before"""
+    if disk_cache is None:
+        return convert_gcode_to_pattern(layer_block, cfg, current_pos, instrumentation)
+    key = DiskCache.key(layer_block, current_pos, cfg.bed_parameters)
+    cached = disk_cache.load(key)
+    if cached is not None:
+        pattern, end_pos = cached
+        current_pos.X, current_pos.Y, current_pos.Z, current_pos.E = end_pos.X, end_pos.Y, end_pos.Z, end_pos.E
+        return pattern
+    pattern = convert_gcode_to_pattern(layer_block, cfg, current_pos, instrumentation)
+    disk_cache.store(key, pattern, current_pos)
+    return pattern
+
+def write_layer(pattern: Pattern, layer_idx: int, cfg: Config, out: TextIO, cache: LayerCache | None = None,
+                instrumentation: Instrumentation | None = None) -> CachedStrokes | None:
+    """Writes the Asterix gcode of a layer to out, reusing the strokes of an identical earlier layer from cache
+
+    Returns:
+        CachedStrokes: the cache entry with the strokes of the layer, or None without a cache
+    """
+    with measure(instrumentation, 'emit'):
+        if cache is None:
+            convert_to_output(pattern, layer_idx, cfg, out, instrumentation)
+            return None
+        key = LayerCache.key(pattern, cfg)
+        entry = cache.get(key)
+        if entry is None:
+            entry = CachedStrokes(convert_pattern_to_strokes(pattern, cfg, instrumentation=instrumentation))
+            cache.put(key, entry)
+        layer_begin_cmd(layer_idx, cfg.machine_dimensions.x_maximum_position, cfg.bed_parameters.deposition_rate, out)
+        out.write(entry.strokes)
+        return entry
+
+def _verify_layer(verifier: Verifier, layer_idx: int, layer_output: str, pattern: Pattern, entry: CachedStrokes | None = None):
+    """Checks the output of a layer with verifier. The result is kept in the cache entry of the strokes of
+    the layer, and reused for an identical layer (the layer header has no valve commands)"""
+    if entry is None:
+        verifier.check_layer(layer_idx, layer_output, pattern)
+        return
+    if entry.mismatching_cells is None:
+        entry.mismatching_cells = verifier.mismatching_cells(layer_output, pattern)
+    verifier.record(layer_idx, entry.mismatching_cells)
+
+@dataclasses.dataclass
+class _LayerResult:
+    """Result of a layer processed in a worker process, see _process_layer
+
+    Attributes:
+        gcode: the Asterix gcode of the layer
+        fill: fill percentage of the layer
+        cache_counts: (hits, misses) of the layer cache for this layer
+        disk_cache_counts: (hits, misses) of the disk cache for this layer
+        mismatches: verification mismatches of the layer, see Verifier
+        timings: timings of the layer when instrumented, see Instrumentation
+        statistics: statistics of the layer when measured, see LayerStatistics.measure
+    """
+    gcode: str
+    fill: float
+    cache_counts: tuple[int, int] = (0, 0)
+    disk_cache_counts: tuple[int, int] = (0, 0)
+    mismatches: list[dict] = dataclasses.field(default_factory=list)
+    timings: dict | None = None
+    statistics: tuple | None = None
+
+# layer cache of a worker process, kept between the layers processed by that worker
+_worker_cache = None
+
+def _process_layer(layer_block: str, layer_idx: int, cfg: Config, current_pos: GCodeMove, cache_size: int | None = None,
+                   disk_cache: DiskCache | None = None, verify: bool = False, instrument: bool = False,
+                   histogram_bins: int = 0) -> _LayerResult:
+    """Rasterizes and encodes a single layer (runs in a worker process)
+
+    Args:
+        cache_size: size of the layer cache of the worker, or None for no layer cache
+        verify: verify the output of the layer
+        instrument: time the stages of the layer
+        histogram_bins: when set, measure the statistics of the layer with this many histogram bins
+    """
+    global _worker_cache
+    cache = None
+    if cache_size is not None:
+        if _worker_cache is None or _worker_cache.maxsize != cache_size:
+            _worker_cache = LayerCache(cache_size)
+        cache = _worker_cache
+    caches = (cache, disk_cache)
+    before = [(c.hits, c.misses) if c is not None else (0, 0) for c in caches]
+
+    instrumentation = Instrumentation() if instrument else None
+    if instrumentation is not None:
+        instrumentation.begin_layer(layer_idx, len(layer_block))
+    pattern = load_or_convert_pattern(layer_block, cfg, current_pos, disk_cache=disk_cache, instrumentation=instrumentation)
+    out = ChunkSink()
+    entry = write_layer(pattern, layer_idx, cfg, out, cache=cache, instrumentation=instrumentation)
+    result = _LayerResult(out.getvalue(), calculate_fill_percentage(pattern))
+    if instrumentation is not None:
+        result.timings = instrumentation.end_layer(result.gcode)
+    result.cache_counts, result.disk_cache_counts = [(c.hits - h, c.misses - m) if c is not None else (0, 0)
+                                                     for c, (h, m) in zip(caches, before)]
+    if verify:
+        verifier = Verifier(cfg)
+        _verify_layer(verifier, layer_idx, result.gcode, pattern, entry)
+        result.mismatches = verifier.mismatches
+    if histogram_bins:
+        result.statistics = LayerStatistics(cfg, histogram_bins).measure(layer_idx, pattern)
+    return result
+
+def _process_layers_parallel(layers: Iterator[tuple[int, str]], out: TextIO, cfg: Config, jobs: int, layer_count: int,
+                             options: JobOptions) -> float:
+    """Processes the layers in a pool of worker processes, and writes the results in layer order.
+
+    The start position of every layer is found with scan_end_position on the previous layer, so
+    the output is identical to processing the layers one after another. At most 2*jobs layers
+    are in flight, to keep memory bounded. When a cache is given, every worker keeps its own
+    layer cache of the same size; the hits and misses are added to `options.cache`. When the end
+    position of a layer is in the disk cache, the pre-scan of that layer is skipped. With a verifier,
+    the workers verify their own layers and the mismatches are added to `options.verifier`. Likewise,
+    the workers time and measure their own layers, and the timings and statistics are added to
+    `options.instrumentation` and `options.layer_stats`. progress is called when a layer is written.
+
+    Returns:
+        float: sum of the fill percentages of all layers
+    """
+    fill_factor = 0
+    current_pos = GCodeMove(0,0,0,0)
+    pending = deque()
+    index, verifier, instrumentation, layer_stats = options.index, options.verifier, options.instrumentation, options.layer_stats
+    disk_cache = options.disk_cache
+    cache_size = options.cache.maxsize if options.cache is not None else None
+
+    def write_result(layer_idx, future):
+        nonlocal fill_factor
+        result = future.result()
+        offset = out.tell() if index is not None else 0
+        out.write(result.gcode)
+        if index is not None:
+            index.add(layer_idx+1, offset, out.tell() - offset, fill_percentage=float(result.fill))
+        fill_factor += result.fill
+        for c, (hits, misses) in ((options.cache, result.cache_counts), (disk_cache, result.disk_cache_counts)):
+            if c is not None:
+                c.hits += hits
+                c.misses += misses
+        if verifier is not None:
+            verifier.layers_checked += 1
+            verifier.mismatches.extend(result.mismatches)
+        if instrumentation is not None:
+            instrumentation.layers.append(result.timings)
+        if layer_stats is not None:
+            layer_stats.add(*result.statistics)
+        if options.progress is not None:
+            options.progress(layer_idx + 1, layer_count)
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for i, layer_block in layers:
+            if isinstance(layer_block, memoryview):
+                layer_block = layer_block.tobytes() # slices of a memory-mapped file can't be sent to a worker
+            pending.append((i, executor.submit(_process_layer, layer_block, i, cfg, current_pos, cache_size=cache_size,
+                                                  disk_cache=disk_cache, verify=verifier is not None,
+                                                  instrument=instrumentation is not None,
+                                                  histogram_bins=layer_stats.bins if layer_stats is not None else 0)))
+            end_pos = None
+            if disk_cache is not None:
+                end_pos = disk_cache.end_position(DiskCache.key(layer_block, current_pos, cfg.bed_parameters))
+            current_pos = end_pos or scan_end_position(layer_block, current_pos)
+            if len(pending) >= 2 * jobs:
+                write_result(*pending.popleft())
+        while pending:
+            write_result(*pending.popleft())
+    return fill_factor
+
+def process_gcode(gcode: str, cfg: Config, jobs: int = 1, options: JobOptions | None = None):
     """takes ins a gcode file, and process it line by line until finished
     it will output the processd gcode suitable for the machine
     """
-    stats = {}
+    out = ChunkSink()
+    stats = process_gcode_stream(gcode.splitlines(keepends=True), out, cfg, jobs=jobs, options=options)
+
+    output_obj = {}
+    output_obj['gcode'] = out.getvalue()
+    output_obj['statistics'] = stats
+
+    return output_obj
+
+def iter_layers(lines: Iterable[str]) -> Iterator[tuple[int, str]]:
+    """Split a stream of Cura gcode lines into layer blocks on the fly.
+
+    The ;LAYER_COUNT: header is yielded first as (layer_count, ""), followed by one
+    (layer_index, layer_block) tuple per layer. A layer block runs from its ;LAYER: marker up
+    to the next marker (or the end of the file). Like index_layers, the first ;LAYER_COUNT:
+    anywhere in the file counts. Cura writes it before the first layer, then only a single
+    layer is held in memory at any time; otherwise the layers are held until it is found.
+
+    Args:
+        lines: iterable of gcode lines, with or without line endings
+
+    Raises:
+        ValueError: If LAYER_COUNT is missing, or doesn't match the number of layers found
+    """
+    layer_count = None
+    pending = [] # layers completed before LAYER_COUNT was found
+    layer = None
+    layer_idx = 0
+    for line in lines:
+        if layer_count is None:
+            layer_count_match = LAYER_COUNT_RE.search(line)
+            if layer_count_match:
+                layer_count = int(layer_count_match.group(1))
+                yield layer_count, ""
+                yield from pending
+                pending = None
+        if line.startswith(";LAYER:"):
+            if layer is not None:
+                if layer_count is None:
+                    pending.append((layer_idx, "".join(layer)))
+                else:
+                    yield layer_idx, "".join(layer)
+                layer_idx += 1
+            layer = []
+        if layer is not None:
+            layer.append(line if line.endswith("\n") else line + "\n")
+
+    if layer_count is None:
+        raise ValueError("Could not find LAYER_COUNT in gcode")
+    if layer is not None:
+        yield layer_idx, "".join(layer)
+        layer_idx += 1
+
+    if layer_idx != layer_count:
+        raise ValueError(f"Found {layer_idx} layers but expected {layer_count}")
 
-    layer_count_match = re.search(r';LAYER_COUNT:(\d+)', gcode)
+def process_gcode_stream(lines: Iterable[str], out: TextIO, cfg: Config, jobs: int = 1,
+                         options: JobOptions | None = None) -> dict:
+    """Process a stream of gcode lines layer by layer, writing the output as it goes.
+
+    Each layer is rasterized into a Pattern and its Asterix gcode is written to `out`
+    before the next layer is read, so peak memory stays at about one layer.
+
+    Args:
+        lines: iterable of gcode lines (e.g. an open file)
+        out: output sink (file-like object) the Asterix gcode is written to
+        cfg: machine configuration
+        jobs: number of worker processes used to process layers in parallel (1 = serial)
+        options: optional caches, verifier, instrumentation, ... of the job, see JobOptions
+
+    Returns:
+        dict: statistics of the processed job
+    """
+    layers = iter_layers(lines)
+    layer_count, _ = next(layers)
+    return process_layers(layer_count, layers, out, cfg, jobs=jobs, options=options)
+
+def index_layers(buf: bytes | mmap.mmap) -> tuple[int, list[int]]:
+    """Builds a byte offset index of all ;LAYER: markers in a single scan of the raw (undecoded) gcode
+
+    Args:
+        buf: the raw gcode, e.g. a memory-mapped file
+
+    Returns:
+        tuple: the layer count and the byte offset of every ;LAYER: marker
+
+    Raises:
+        ValueError: If LAYER_COUNT is missing, or doesn't match the number of layers found
+    """
+    layer_count_match = LAYER_COUNT_RE_BYTES.search(buf)
     if not layer_count_match:
         raise ValueError("Could not find LAYER_COUNT in gcode")
-    
     layer_count = int(layer_count_match.group(1))
-    print(f"Found {layer_count} layers in gcode")
+
+    offsets = [m.start() for m in LAYER_MARKER_RE_BYTES.finditer(buf)]
+    if len(offsets) != layer_count:
+        raise ValueError(f"Found {len(offsets)} layers but expected {layer_count}")
+    return layer_count, offsets
+
+def iter_layer_views(view: memoryview, offsets: list[int]) -> Iterator[tuple[int, memoryview]]:
+    """Yields (layer_index, layer_block) for every layer, as zero-copy slices of view
+
+    A slice is released as soon as the next layer is requested, so the layer must not be used after that.
+    """
+    ends = offsets[1:] + [len(view)]
+    for i, (start, end) in enumerate(zip(offsets, ends)):
+        with view[start:end] as layer_block:
+            yield i, layer_block
+
+def process_layers(layer_count: int, layers: Iterable[tuple[int, str | bytes | memoryview]], out: TextIO, cfg: Config, jobs: int = 1,
+                   options: JobOptions | None = None) -> dict:
+    """Process the layers of a job one by one, writing the output as it goes.
+
+    Args:
+        layer_count: number of layers in the job
+        layers: iterable of (layer_index, layer_block) tuples
+        out: output sink (file-like object) the Asterix gcode is written to
+        cfg: machine configuration
+        jobs: number of worker processes used to process layers in parallel (1 = serial)
+        options: optional caches, layer index, verifier, ... of the job, see JobOptions
+
+    Returns:
+        dict: statistics of the processed job
+    """
+    options = options or JobOptions()
+    cache, disk_cache, index = options.cache, options.disk_cache, options.index
+    verifier, instrumentation, progress, layer_stats = options.verifier, options.instrumentation, options.progress, options.layer_stats
+    stats = {}
+    if instrumentation is not None:
+        instrumentation.start()
+    if progress is not None:
+        progress(0, layer_count)
     stats["layers found"] = str(layer_count)
     stats["feedrate"] = str(cfg.machine_dimensions.y_feed_rate)
-    output = print_begin_cmd(layer_count)
-    
-    # Find all layer indices by iterating once through the lines
-    layer_indices = []
-    for i, line in enumerate(gcode.splitlines()):
-        if line.startswith(";LAYER:"):
-            layer_indices.append(i)
-    
-    if len(layer_indices) != layer_count:
-        raise ValueError(f"Found {len(layer_indices)} layers but expected {layer_count}")
-    
-    fill_factor = 0
-    # Process each layer block using the line indices
-    lines = gcode.splitlines()
-    current_pos = GCodeMove(0,0,0,0)
-    for i in range(layer_count):
-        start_line = layer_indices[i]
-        if i < layer_count - 1:
-            end_line = layer_indices[i + 1]
-            layer_block = "\n".join(lines[start_line:end_line])
-        else:
-            # Last layer - take rest of file
-            layer_block = "\n".join(lines[start_line:])
-            
-        print(f"Processing layer {i+1}")
-        pattern = convert_gcode_to_pattern(layer_block, cfg, current_pos)
-        fill_factor += calculate_fill_percentage(pattern)
-        output += convert_to_output(pattern, i, cfg)
+    valve_count = ValveEncoder.for_config(cfg).values
+    print_begin_cmd(layer_count, out, valve_count)
+    if cfg.output.merge_rows or cfg.output.trim_strokes:
+        out = LineCountingSink(out) # to report the number of commands saved
+
+    if jobs > 1:
+        fill_factor = _process_layers_parallel(layers, out, cfg, jobs, layer_count=layer_count, options=options)
+    else:
+        fill_factor = 0
+        current_pos = GCodeMove(0,0,0,0)
+        for i, layer_block in layers:
+            if instrumentation is not None:
+                instrumentation.begin_layer(i, len(layer_block))
+            pattern = load_or_convert_pattern(layer_block, cfg, current_pos, disk_cache=disk_cache, instrumentation=instrumentation)
+            fill = calculate_fill_percentage(pattern)
+            fill_factor += fill
+            if layer_stats is not None:
+                layer_stats.add_layer(i, pattern)
+            offset = out.tell() if index is not None else 0
+            if verifier is not None or instrumentation is not None:
+                layer_out = ChunkSink()
+                entry = write_layer(pattern, i, cfg, layer_out, cache=cache, instrumentation=instrumentation)
+                layer_output = layer_out.getvalue()
+                if instrumentation is not None:
+                    instrumentation.end_layer(layer_output)
+                if verifier is not None:
+                    _verify_layer(verifier, i, layer_output, pattern, entry)
+                out.write(layer_output)
+            else:
+                write_layer(pattern, i, cfg, out, cache=cache)
+            if index is not None:
+                index.add(i+1, offset, out.tell() - offset, fill_percentage=float(fill))
+            if progress is not None:
+                progress(i + 1, layer_count)
 
     stats['Fill factor'] = fill_factor / layer_count
-    output += print_end_cmd(layer_count)
-    
-    output_obj = {}
-    output_obj['gcode'] = output
-    output_obj['statistics'] = stats
+    if cfg.output.merge_rows or cfg.output.trim_strokes:
+        template = StrokeTemplate.for_config(cfg, cfg.get_bed_array_size()[1], valve_count)
+        begin_lines = layer_begin_cmd(0, cfg.machine_dimensions.x_maximum_position, cfg.bed_parameters.deposition_rate).count("\n")
+        unmerged = layer_count * (begin_lines + template.line_count)
+        stats['layer commands'] = out.lines
+        stats['layer commands unmerged'] = unmerged
+        stats['command reduction (%)'] = 100 * (1 - out.lines / unmerged) if unmerged else 0.0
+        out = out.out
+    if cache is not None:
+        stats['layer cache hits'] = cache.hits
+        stats['layer cache misses'] = cache.misses
+    if disk_cache is not None:
+        stats['disk cache hits'] = disk_cache.hits
+        stats['disk cache misses'] = disk_cache.misses
+    if verifier is not None:
+        stats['verified layers'] = verifier.layers_checked
+        stats['verification mismatches'] = len(verifier.mismatches)
+    if layer_stats is not None:
+        stats.update(layer_stats.statistics())
+    print_end_cmd(layer_count, out)
+    if instrumentation is not None:
+        instrumentation.stop()
+        stats.update(instrumentation.statistics())
+    return stats
+
+def process_gcode_file(input_file: str, output_file: str, cfg: Config, jobs: int = 1, options: JobOptions | None = None,
+                       use_mmap: bool = True, write_index: bool = True) -> dict:
+    """Process a Cura gcode file into an Asterix gcode file, streaming layer by layer.
+
+    By default the input file is memory-mapped: the layers are found with a single scan over the
+    raw bytes (index_layers) and every layer is parsed from a zero-copy slice, without decoding
+    the file. With use_mmap=False the file is read as text, line by line.
+
+    Unless write_index is False, a sidecar LayerIndex is written next to the output file, see
+    LayerIndex.index_path. The output is written to a temporary file first and renamed when
+    complete, so on an error the output file is left as it was.
+
+    Args:
+        input_file: path of the gcode file generated by Cura
+        output_file: path the processed gcode is written to
+        cfg: machine configuration
+        jobs: number of worker processes used to process layers in parallel (1 = serial)
+        options: optional caches, verifier, instrumentation, ... of the job, see JobOptions; its index
+            is replaced by the sidecar index
+        use_mmap: read the input through a memory-mapped file
+        write_index: write a sidecar layer index next to the output file
+
+    Returns:
+        dict: statistics of the processed job
+    """
+    index = LayerIndex() if write_index else None
+    options = dataclasses.replace(options or JobOptions(), index=index)
+    # buffer about one stroke of output, so it goes to disk in large writes
+    buffer_size = max(io.DEFAULT_BUFFER_SIZE, cfg.bed_parameters.y_size_mm * EXPECTED_LEN_ONE_ENTRY)
+    # the output goes to a temporary file that is renamed when complete, so an error never leaves
+    # a truncated output file (or an index of one) behind
+    partial_file = f"{output_file}.part"
+    try:
+        if not use_mmap:
+            with open(input_file, 'r') as f_in, open(partial_file, 'w', buffering=buffer_size) as f_out:
+                layers = iter_layers(f_in)
+                layer_count, _ = next(layers)
+                stats = process_layers(layer_count, layers, f_out, cfg, jobs=jobs, options=options)
+        else:
+            if os.path.getsize(input_file) == 0:
+                raise ValueError("Could not find LAYER_COUNT in gcode")
+            with open(input_file, 'rb') as f_in, mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                layer_count, offsets = index_layers(mm)
+                with memoryview(mm) as view, open(partial_file, 'w', buffering=buffer_size) as f_out:
+                    layers = iter_layer_views(view, offsets)
+                    try:
+                        stats = process_layers(layer_count, layers, f_out, cfg, jobs=jobs, options=options)
+                    finally:
+                        layers.close() # releases the last layer slice, before the file is unmapped
 
-    return output_obj
\ No newline at end of file
+        if index is not None:
+            index.file_size = os.path.getsize(partial_file)
+            index.save(LayerIndex.index_path(partial_file))
+            os.replace(LayerIndex.index_path(partial_file), LayerIndex.index_path(output_file))
+        os.replace(partial_file, output_file)
+    except BaseException:
+        for path in (partial_file, LayerIndex.index_path(partial_file)):
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    return stats
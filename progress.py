@@ -0,0 +1,58 @@
+import sys
+import time
+from typing import Callable, TextIO
+
+# progress callback: called with (layers_done, layer_count), first with layers_done = 0 when the
+# number of layers is known, and after every processed layer
+ProgressCallback = Callable[[int, int], None]
+
+def format_duration(seconds: float) -> str:
+    """Formats a duration as mm:ss, or hh:mm:ss when it takes an hour or more"""
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    mins, secs = divmod(rest, 60)
+    return f"{hours}:{mins:02d}:{secs:02d}" if hours else f"{mins:02d}:{secs:02d}"
+
+class ProgressReporter:
+    """Progress callback that prints the processed layers, throughput and ETA, at most every `interval` seconds
+
+    On a terminal the progress line is overwritten in place, otherwise every update is printed
+    on a new line. The first and the last update are always printed.
+    """
+
+    def __init__(self, stream: TextIO = sys.stdout, interval: float = 0.5, clock: Callable[[], float] = time.monotonic):
+        self.stream = stream
+        self.interval = interval
+        self.clock = clock
+        self._start = None
+        self._last_report = None
+        self._in_place = hasattr(stream, 'isatty') and stream.isatty()
+        self._width = 0 # length of the line to overwrite
+
+    def __call__(self, layers_done: int, layer_count: int):
+        now = self.clock()
+        if layers_done == 0:
+            self._start = now
+            self._last_report = None
+            self.stream.write(f"Found {layer_count} layers in gcode\n")
+            return
+        finished = layers_done >= layer_count
+        if not finished and self._last_report is not None and now - self._last_report < self.interval:
+            return
+        self._last_report = now
+
+        elapsed = now - self._start
+        line = f"Processing layer {layers_done}/{layer_count} ({100 * layers_done / layer_count:.0f}%)"
+        if elapsed > 0:
+            rate = layers_done / elapsed
+            line += f", {rate:.1f} layers/s"
+            if not finished:
+                line += f", ETA {format_duration((layer_count - layers_done) / rate)}"
+            else:
+                line += f", done in {format_duration(elapsed)}"
+        if self._in_place:
+            self.stream.write("\r" + line.ljust(self._width) + ("\n" if finished else ""))
+            self._width = len(line)
+        else:
+            self.stream.write(line + "\n")
+        self.stream.flush()
@@ -0,0 +1,155 @@
+"""Benchmark of the processing pipeline: parse -> rasterize -> encode -> emit
+
+Generates a synthetic Cura-like job and times every stage separately. The results are saved as
+JSON, and can be compared against the results of an earlier version with --compare.
+
+Usage:
+    python scripts/benchmark.py --layers 50 --density 0.2 --output benchmark.json
+    python scripts/benchmark.py --compare benchmark.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from typing import Callable
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from config import Config
+from gcode import GCodeMove
+from process import convert_gcode_to_pattern, convert_to_output, iter_layers, process_gcode
+from util import list_of_bits_to_list_of_int, ValveEncoder
+
+HEADER = """;FLAVOR:Marlin
+;Generated with benchmark.py
+M82 ;absolute extrusion mode
+G92 E0
+G1 F1500 E-6.5
+"""
+
+def generate_cura_gcode(cfg: Config, layers: int = 10, density: float = 0.2, part_size: float = 0.6,
+                        layer_height: float = 2.5) -> str:
+    """Generates a Cura-like gcode job: a block printed with vertical infill lines
+
+    Args:
+        cfg: machine configuration, the block is centered on the bed from BedParameters
+        layers: number of layers
+        density: infill density, 1 prints a line in every nozzle column
+        part_size: size of the block as a fraction of the bed, in both directions
+        layer_height: layer height in mm
+
+    Returns:
+        str: the gcode of the job
+    """
+    bed = cfg.bed_parameters
+    x_min = bed.x_size_mm * (1 - part_size) / 2
+    x_max = bed.x_size_mm - x_min
+    y_min = bed.y_size_mm * (1 - part_size) / 2
+    y_max = bed.y_size_mm - y_min
+    step = bed.resolution_mm / density
+
+    lines = [HEADER, f";LAYER_COUNT:{layers}\n"]
+    e = 0.0
+    for layer in range(layers):
+        z = (layer + 1) * layer_height
+        # like Cura, the infill of every other layer is shifted
+        xs = np.arange(x_min + (layer % 2) * step / 2, x_max, step)
+        lines.append(f";LAYER:{layer}\nM107\n;MESH:Block\nG0 F3600 X{xs[0]:.3f} Y{y_min:.3f} Z{z:.1f}\n;TYPE:FILL\n")
+        for i, x in enumerate(xs):
+            y_from, y_to = (y_min, y_max) if i % 2 == 0 else (y_max, y_min)
+            e += (y_max - y_min) * 0.05
+            lines.append(f"G0 F3600 X{x:.3f} Y{y_from:.3f}\nG1 F1800 X{x:.3f} Y{y_to:.3f} E{e:.5f}\n")
+    lines.append("M107\nM82 ;absolute extrusion mode\nM104 S0\n;End of Gcode\n")
+    return "".join(lines)
+
+def time_stage(func: Callable[[], object], repeat: int) -> dict:
+    """Runs func `repeat` times and returns the min and median duration in seconds"""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return {'min': min(durations), 'median': statistics.median(durations), 'runs': repeat}
+
+def run_benchmark(cfg: Config, layers: int, density: float, part_size: float, repeat: int) -> dict:
+    gcode = generate_cura_gcode(cfg, layers, density, part_size)
+    move_lines = [line for line in gcode.splitlines() if line.startswith(('G0', 'G1'))]
+    layer_iter = iter_layers(gcode.splitlines(keepends=True))
+    next(layer_iter)
+    layer_blocks = [block for _, block in layer_iter]
+
+    def rasterize():
+        current_pos = GCodeMove(0, 0, 0, 0)
+        return [convert_gcode_to_pattern(block, cfg, current_pos) for block in layer_blocks]
+    patterns = rasterize()
+
+    def encode_rows():
+        for pattern in patterns:
+            for row in range(pattern.get_number_of_rows()):
+                list_of_bits_to_list_of_int(pattern[::2, row])
+                list_of_bits_to_list_of_int(pattern[1::2, row])
+
+    encoder = ValveEncoder.for_config(cfg)
+
+    stages = {
+        'GCodeMove.fromstring': lambda: [GCodeMove.fromstring(line) for line in move_lines],
+        'convert_gcode_to_pattern': rasterize,
+        'list_of_bits_to_list_of_int': encode_rows,
+        'ValveEncoder.encode': lambda: [encoder.encode(pattern) for pattern in patterns],
+        'convert_to_output': lambda: [convert_to_output(p, i, cfg) for i, p in enumerate(patterns)],
+        'process_gcode': lambda: process_gcode(gcode, cfg),
+    }
+    timings = {}
+    for name, func in stages.items():
+        print(f"Timing {name}...", file=sys.stderr)
+        timings[name] = time_stage(func, repeat)
+
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'parameters': {'layers': layers, 'density': density, 'part_size': part_size, 'repeat': repeat,
+                       'bed_size': list(cfg.get_bed_array_size())},
+        'input': {'bytes': len(gcode), 'move_lines': len(move_lines)},
+        'timings': timings,
+    }
+
+def print_results(results: dict, baseline: dict | None = None):
+    print(f"{'stage':<30} {'min (s)':>10} {'median (s)':>11}" + (f" {'vs baseline':>12}" if baseline else ""))
+    print("-" * (53 + (13 if baseline else 0)))
+    for name, timing in results['timings'].items():
+        line = f"{name:<30} {timing['min']:>10.4f} {timing['median']:>11.4f}"
+        if baseline and name in baseline['timings']:
+            line += f" {timing['min'] / baseline['timings'][name]['min']:>11.2f}x"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the gcode processing pipeline")
+    parser.add_argument('--config', default='machine.toml', help="machine configuration file (default: machine.toml)")
+    parser.add_argument('--layers', type=int, default=20, help="number of layers of the synthetic job (default: 20)")
+    parser.add_argument('--density', type=float, default=0.2, help="infill density, 0-1 (default: 0.2)")
+    parser.add_argument('--part-size', type=float, default=0.6, help="size of the part as a fraction of the bed (default: 0.6)")
+    parser.add_argument('--repeat', type=int, default=3, help="number of runs of every stage (default: 3)")
+    parser.add_argument('--output', default='benchmark.json', help="file the results are saved to (default: benchmark.json)")
+    parser.add_argument('--compare', default=None, help="results of an earlier run, to compare against")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+
+    cfg = Config.from_file(args.config)
+    results = run_benchmark(cfg, args.layers, args.density, args.part_size, args.repeat)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print_results(results, baseline)
+
+if __name__ == "__main__":
+    main()
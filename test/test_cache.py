@@ -0,0 +1,118 @@
+import numpy as np
+from cache import LayerCache
+from config import Config
+from decoder import Verifier
+from pattern import Pattern, PackedPattern
+from process import process_gcode, JobOptions
+
+def test_layer_cache_lru():
+    cache = LayerCache(maxsize=2)
+    cache.put(b'a', "A")
+    cache.put(b'b', "B")
+    assert cache.get(b'a') == "A" # a is now most recently used
+    cache.put(b'c', "C") # evicts b
+    assert cache.get(b'b') is None
+    assert cache.get(b'c') == "C"
+    assert len(cache) == 2
+    assert (cache.hits, cache.misses) == (2, 1)
+
+def test_layer_cache_key():
+    p1 = Pattern((16, 10))
+    p2 = Pattern((16, 10))
+    assert LayerCache.key(p1) == LayerCache.key(p2)
+    p2.add_line(3, 2, 5)
+    assert LayerCache.key(p1) != LayerCache.key(p2)
+    assert LayerCache.key(p1) != LayerCache.key(Pattern((10, 16)))
+    assert LayerCache.key(PackedPattern.from_pattern(p2)) == LayerCache.key(PackedPattern.from_pattern(p2))
+
+def repeated_layers_gcode(layer_count: int) -> str:
+    gcode = f";LAYER_COUNT:{layer_count}\n"
+    for i in range(layer_count):
+        gcode += (f";LAYER:{i}\n"
+                  f"G0 F3600 X300 Y400 Z{(i+1)*2.5}\n"
+                  "G1 F1800 X300 Y500 E10\n"
+                  "G0 X305 Y500\n"
+                  "G1 X305 Y420 E20\n")
+    return gcode
+
+def test_process_gcode_with_cache():
+    cfg = Config.from_file('machine.toml')
+    gcode = repeated_layers_gcode(4)
+
+    expected = process_gcode(gcode, cfg)
+    cache = LayerCache()
+    output = process_gcode(gcode, cfg, options=JobOptions(cache=cache))
+    assert output['gcode'] == expected['gcode']
+    assert output['statistics']['layer cache hits'] == 3
+    assert output['statistics']['layer cache misses'] == 1
+
+    output = process_gcode(gcode, cfg, jobs=2, options=JobOptions(cache=LayerCache()))
+    assert output['gcode'] == expected['gcode']
+    assert output['statistics']['layer cache hits'] + output['statistics']['layer cache misses'] == 4
+
+    # a cache reused after a configuration change doesn't return the strokes of the old configuration
+    for option, value in (('machine_dimensions.y_feed_rate', 4615), ('output.merge_rows', True)):
+        section, name = option.split('.')
+        setattr(getattr(cfg, section), name, value)
+        output = process_gcode(gcode, cfg, options=JobOptions(cache=cache))
+        same_output = output['gcode'] == process_gcode(gcode, cfg)['gcode']
+        assert same_output
+    assert "F4615" in output['gcode'] and "F6137" not in output['gcode']
+
+def test_verification_kept_with_cached_strokes():
+    cfg = Config.from_file('machine.toml')
+    gcode = repeated_layers_gcode(4)
+    cache = LayerCache()
+    verifier = Verifier(cfg)
+    stats = process_gcode(gcode, cfg, options=JobOptions(cache=cache, verifier=verifier))['statistics']
+    assert (stats['verified layers'], stats['verification mismatches']) == (4, 0)
+    entry, = cache._entries.values()
+    assert entry.mismatching_cells == []
+
+    # identical layers reuse the result with the strokes, instead of decoding them again
+    entry.mismatching_cells = [(0, 1)]
+    verifier = Verifier(cfg)
+    process_gcode(gcode, cfg, options=JobOptions(cache=cache, verifier=verifier))
+    assert [mismatch['layer'] for mismatch in verifier.mismatches] == [1, 2, 3, 4]
+
+from cache import DiskCache
+from gcode import GCodeMove
+
+def test_disk_cache(tmp_path):
+    cfg = Config.from_file('machine.toml')
+    disk_cache = DiskCache(tmp_path / "cache")
+
+    key = DiskCache.key(";LAYER:0\nG1 X5 Y10\n", GCodeMove(0, 0, 0, 0), cfg.bed_parameters)
+    assert key != DiskCache.key(";LAYER:0\nG1 X5 Y11\n", GCodeMove(0, 0, 0, 0), cfg.bed_parameters)
+    assert key != DiskCache.key(";LAYER:0\nG1 X5 Y10\n", GCodeMove(1, 0, 0, 0), cfg.bed_parameters)
+    assert disk_cache.load(key) is None
+
+    p = Pattern((176, 20))
+    p.add_line(7, 3, 12)
+    disk_cache.store(key, p, GCodeMove(5.5, 10, None, 2.5))
+    pattern, end_pos = disk_cache.load(key)
+    assert (pattern == p).all()
+    assert (end_pos.X, end_pos.Y, end_pos.Z, end_pos.E) == (5.5, 10, None, 2.5)
+    assert disk_cache.end_position(key).X == 5.5
+    assert (disk_cache.hits, disk_cache.misses) == (1, 1)
+
+def test_process_gcode_with_disk_cache(tmp_path):
+    cfg = Config.from_file('machine.toml')
+    with open("test/test_1_input.gcode", 'r') as f:
+        gcode = f.read()
+    expected = process_gcode(gcode, cfg)
+
+    output = process_gcode(gcode, cfg, options=JobOptions(disk_cache=DiskCache(tmp_path)))
+    assert output['gcode'] == expected['gcode']
+    assert output['statistics']['disk cache misses'] == 10
+
+    # second run only changes the feedrate, all layers come from the cache
+    cfg.machine_dimensions.y_feed_rate = 4615
+    expected = process_gcode(gcode, cfg)
+    output = process_gcode(gcode, cfg, options=JobOptions(disk_cache=DiskCache(tmp_path)))
+    assert output['gcode'] == expected['gcode']
+    assert output['statistics']['disk cache hits'] == 10
+
+    output = process_gcode(gcode, cfg, jobs=2, options=JobOptions(disk_cache=DiskCache(tmp_path)))
+    assert output['gcode'] == expected['gcode']
+    assert output['statistics']['disk cache hits'] == 10
@@ -0,0 +1,54 @@
+import json
+import shutil
+from cli import main, build_parser, output_path, stats_path, layer_stats_path
+from config import Config
+from process import process_gcode
+
+def test_process_files(tmp_path):
+    inputs = []
+    for name in ("a.gcode", "b.gcode"):
+        shutil.copy("test/test_1_input.gcode", tmp_path / name)
+        inputs.append(str(tmp_path / name))
+    (tmp_path / "broken.gcode").write_text("G1 X1 Y1\n")
+    inputs.append(str(tmp_path / "broken.gcode"))
+    out_dir = tmp_path / "out"
+
+    assert main(["process", *inputs, "--jobs", "2", "--out-dir", str(out_dir), "--verify"]) == 1
+
+    with open("test/test_1_input.gcode", 'r') as f:
+        expected = process_gcode(f.read(), Config.from_file('machine.toml'))['gcode']
+    for name in ("a.gcode", "b.gcode"):
+        output_file = output_path(name, str(out_dir))
+        with open(output_file, 'r') as f:
+            same_output = f.read() == expected
+        assert same_output
+        with open(stats_path(output_file), 'r') as f:
+            summary = json.load(f)
+        assert summary['error'] is None
+        assert summary['statistics']['layers found'] == "10"
+        assert summary['verification'] == []
+    with open(stats_path(output_path("broken.gcode", str(out_dir))), 'r') as f:
+        assert "LAYER_COUNT" in json.load(f)['error']
+
+def test_estimate(tmp_path, capsys):
+    output_file = tmp_path / "a_processed.gcode"
+    with open("test/test_1_input.gcode", 'r') as f:
+        output_file.write_text(process_gcode(f.read(), Config.from_file('machine.toml'))['gcode'])
+
+    assert main(["estimate", str(output_file), "--feed-rates", "4615", "6000", "--per-layer"]) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].startswith(f"{output_file}: 10 layers, estimated machine time ")
+    assert lines[10].startswith("  layer    10: ")
+    assert lines[11].startswith("  at F4615: ") and lines[12].startswith("  at F6000: ")
+
+def test_process_layer_stats(tmp_path):
+    shutil.copy("test/test_1_input.gcode", tmp_path / "a.gcode")
+    assert main(["process", str(tmp_path / "a.gcode"), "--jobs", "1", "--layer-stats"]) == 0
+    with open(layer_stats_path(output_path(str(tmp_path / "a.gcode"))), 'r') as f:
+        assert len(json.load(f)['layers']) == 10
+
+def test_watch_arguments():
+    args = build_parser().parse_args(["watch", "jobs", "--merge-rows", "--trim-strokes", "--layer-stats"])
+    assert args.merge_rows and args.trim_strokes and args.layer_stats
+    args = build_parser().parse_args(["process", "a.gcode"])
+    assert not (args.merge_rows or args.trim_strokes or args.layer_stats or args.verify)
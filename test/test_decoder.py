@@ -0,0 +1,84 @@
+import pytest
+import numpy as np
+from config import Config
+from decoder import decode_layer, decode_file, Verifier
+from gcode import GCodeMove
+from pattern import Pattern
+from process import convert_to_output, convert_gcode_to_pattern, iter_layers, process_gcode, process_gcode_file, JobOptions
+
+def test_decode_layer():
+    cfg = Config.from_file('machine.toml')
+    rng = np.random.default_rng(0)
+    p = rng.integers(0, 2, size=cfg.get_bed_array_size(), dtype=np.uint8).view(Pattern)
+
+    decoded, valves_set = decode_layer(convert_to_output(p, 0, cfg), cfg)
+    rows = p.get_number_of_rows()
+    # first pass sets the valves on every odd row, the back pass on every second row from the end
+    assert valves_set[0].tolist() == [i % 2 == 1 for i in range(rows)]
+    assert valves_set[1].tolist() == [(rows - 1 - i) % 2 == 1 for i in range(rows)]
+    assert (decoded[::2, valves_set[0]] == p[::2, valves_set[0]]).all()
+    assert (decoded[1::2, valves_set[1]] == p[1::2, valves_set[1]]).all()
+    # in between, the state of the previous VALVES_SET is held
+    assert (decoded[::2, 2] == p[::2, 1]).all()
+    assert (decoded[1::2, rows - 3] == p[1::2, rows - 2]).all()
+
+    # a VALVES_SET that doesn't directly follow its move still gets the row of the last move
+    gcode = convert_to_output(p, 0, cfg).replace("\nVALVES_SET", "\nG4 P0\n\nVALVES_SET")
+    assert (decode_layer(gcode, cfg)[0] == decoded).all()
+
+def test_decode_file(tmp_path):
+    cfg = Config.from_file('machine.toml')
+    output_file = tmp_path / "test_1_processed.gcode"
+    process_gcode_file("test/test_1_input.gcode", output_file, cfg)
+
+    program = decode_file(output_file, cfg)
+    assert program.patterns.shape == (10, 176, 1343)
+    assert [h['layer'] for h in program.headers] == list(range(1, 11))
+    assert program.headers[2]['lines'][1] == "SET_PRINT_STATS_INFO CURRENT_LAYER=3"
+
+    with open("test/test_1_input.gcode", 'r') as f:
+        layers = iter_layers(f)
+        next(layers)
+        current_pos = GCodeMove(0, 0, 0, 0)
+        for i, layer_block in layers:
+            p = convert_gcode_to_pattern(layer_block, cfg, current_pos)
+            for second_pass in (0, 1):
+                rows = program.valves_set[i, second_pass]
+                assert (program.patterns[i, second_pass::2][:, rows] == p[second_pass::2][:, rows]).all()
+
+def test_verifier():
+    cfg = Config.from_file('machine.toml')
+    rng = np.random.default_rng(1)
+    p = rng.integers(0, 2, size=cfg.get_bed_array_size(), dtype=np.uint8).view(Pattern)
+    gcode = convert_to_output(p, 0, cfg)
+
+    verifier = Verifier(cfg)
+    assert verifier.check_layer(0, gcode, p)
+
+    # flip nozzle 5 (second pass) on the last row, which the back pass samples
+    rows = p.get_number_of_rows()
+    q = p.copy()
+    q[5, rows - 2] ^= 1
+    assert not verifier.check_layer(3, gcode, q)
+    assert verifier.layers_checked == 2
+    assert verifier.mismatches == [{'layer': 4, 'cells': 1, 'first cells': [(5, rows - 2)]}]
+
+def test_process_gcode_verify():
+    cfg = Config.from_file('machine.toml')
+    with open("test/test_1_input.gcode", 'r') as f:
+        gcode = f.read()
+    for jobs in (1, 2):
+        verifier = Verifier(cfg)
+        output = process_gcode(gcode, cfg, jobs, options=JobOptions(verifier=verifier))
+        assert verifier.layers_checked == 10
+        assert verifier.mismatches == []
+        assert output['statistics']['verification mismatches'] == 0
+
+from decoder import _parse_integers
+def test_parse_integers():
+    # the widest segment is the last one, and ends in an integer shorter than the longest one
+    buf = np.frombuffer(b'A:123,3\nB:12345,2', np.uint8)
+    assert _parse_integers(buf, np.array([2, 10]), np.array([7, 17]), 2).tolist() == [[123, 3], [12345, 2]]
+    assert _parse_integers(buf, np.array([2, 10]), np.array([7, 17]), 1).tolist() == [[123], [12345]]
+    with pytest.raises(ValueError):
+        _parse_integers(buf, np.array([2, 10]), np.array([7, 17]), 3)
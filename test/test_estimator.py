@@ -0,0 +1,64 @@
+import time
+import numpy as np
+from config import Config
+from process import process_gcode
+from estimator import estimate_program, estimate_job, combined_feed_rate
+
+def _config(y_feed_rate=None) -> Config:
+    cfg = Config.from_file('machine.toml')
+    cfg.macro_times.homing = 5.0
+    cfg.macro_times.z_one_layer = 2.0
+    cfg.macro_times.valves_set = 0.01
+    if y_feed_rate is not None:
+        cfg.machine_dimensions.y_feed_rate = y_feed_rate
+    return cfg
+
+def test_estimate_program():
+    cfg = Config.from_file('machine.toml')
+    dims = cfg.machine_dimensions
+    program = [
+        "G28 X Y\n",
+        "G4 P1500\n",
+        ";Layer1\n",
+        "Z_ONE_LAYER\n",
+        f"G1 X{dims.x_maximum_position} F6000; deposit material\n",
+        f"G1 Y100 X{dims.x_maximum_position - 100} F{combined_feed_rate(dims.y_feed_rate)}\n",
+        f"G1 Y200 X0 F{dims.y_feed_rate}\n",
+        "G1 Y0\n",
+    ]
+    estimate = estimate_program(program, cfg)
+    assert estimate.start.fixed_time == 1.5
+    assert len(estimate.layers) == 1
+    layer = estimate.layers[0]
+    assert np.isclose(layer.other_time, 60 * dims.x_maximum_position / 6000)
+    assert np.isclose(layer.combined_distance, 100 * np.sqrt(2))
+    assert np.isclose(layer.feed_distance, np.hypot(dims.x_maximum_position - 100, 100) + 200)
+
+    cfg.macro_times.z_one_layer = 2.0
+    assert estimate_program(program, cfg).layers[0].fixed_time == 2.0
+
+def test_estimate_job_matches_program():
+    with open("test/test_1_input.gcode", 'r') as f:
+        gcode = f.read()
+    cfg = _config()
+    estimate = estimate_program(process_gcode(gcode, cfg)['gcode'].splitlines(), cfg)
+    assert len(estimate.layers) == 10
+    job = estimate_job(cfg, 10)
+    assert np.allclose(job.layer_times(), estimate.layer_times())
+    assert np.isclose(job.total(), estimate.total())
+
+    # evaluating at another feedrate gives the same time as processing with that feedrate
+    other_cfg = _config(4615)
+    other = estimate_program(process_gcode(gcode, other_cfg)['gcode'].splitlines(), other_cfg)
+    assert np.isclose(estimate.total(4615), other.total())
+    assert np.allclose(estimate.layer_times(4615), other.layer_times())
+
+def test_sweep():
+    job = estimate_job(_config(), 500)
+    feed_rates = np.arange(3000, 9000)
+    start = time.perf_counter()
+    totals = job.sweep(feed_rates)
+    assert time.perf_counter() - start < 1
+    assert np.all(np.diff(totals) < 0) # faster printing, shorter job
+    assert np.isclose(totals[6137 - 3000], job.total())
+    assert np.isclose(totals[0], job.total(3000))
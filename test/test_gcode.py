@@ -28,3 +28,72 @@ def test_gcodemove_init():
     with pytest.raises(ValueError):
         g = GCodeMove.fromstring("G2 X3 Y5")
     
+
+from gcode import scan_moves
+
+def test_scan_moves():
+    gcode = """;LAYER:0
+M107
+G0 F3600 X303.33 Y444.855 Z2.5
+;TYPE:FILL
+G1 F1500 E0
+G1 F1800 X303.33 Y464.855 E39.18866
+G1 F1500
+G2 X3 Y5
+G0 Y-12 ;comment"""
+    moves = list(scan_moves(gcode))
+    assert moves == [(False, 303.33, 444.855, 2.5, None),
+                     (True, None, None, None, 0.0),
+                     (True, 303.33, 464.855, None, 39.18866),
+                     (False, None, -12.0, None, None)]
+
+def test_scan_moves_matches_fromstring():
+    with open("test/test_1_input.gcode", 'r') as f:
+        gcode = f.read()
+
+    expected = []
+    for line in gcode.splitlines():
+        try:
+            g = GCodeMove.fromstring(line)
+        except ValueError:
+            continue
+        expected.append((g.is_G1_command(), g.X, g.Y, g.Z, g.E))
+    assert list(scan_moves(gcode)) == expected
+
+import numpy as np
+from gcode import MoveBuffer
+
+def test_gcodemove_slots():
+    g = GCodeMove(1, 2, 3, 4)
+    assert not hasattr(g, '__dict__')
+    with pytest.raises(AttributeError):
+        g.F = 1500
+
+def test_move_buffer():
+    gcode = """G0 X5 Y10
+M107
+G1 Y20 E1
+G0 X0 Y0
+G1 X10"""
+    moves = MoveBuffer.from_gcode(gcode)
+    assert len(moves) == 4
+    assert moves.is_extrude.tolist() == [False, True, False, True]
+    assert np.isnan(moves.X[1])
+
+    begin_x, begin_y, end_x, end_y = moves.resolve(GCodeMove(0, 0, 0, 0))
+    assert begin_x.tolist() == [0, 5, 5, 5]
+    assert begin_y.tolist() == [0, 10, 20, 20] # zero coordinates don't update the current position
+    assert end_x.tolist() == [5, 5, 0, 10]
+    assert end_y.tolist() == [10, 20, 0, 20]
+
+    pos = GCodeMove(0, 0, 0, 0)
+    moves.update_position(pos)
+    expected = GCodeMove(0, 0, 0, 0)
+    for line in gcode.splitlines():
+        try:
+            expected.update(GCodeMove.fromstring(line))
+        except ValueError:
+            continue
+    assert (pos.X, pos.Y, pos.Z, pos.E) == (expected.X, expected.Y, expected.Z, expected.E)
+
+    assert len(MoveBuffer.from_gcode("M107")) == 0
@@ -0,0 +1,53 @@
+import csv
+import json
+import time
+from config import Config
+from instrumentation import Instrumentation, STAGES
+from process import process_gcode, JobOptions
+
+def test_nested_stages():
+    instrumentation = Instrumentation()
+    instrumentation.start()
+    instrumentation.begin_layer(0, 100)
+    with instrumentation.stage('emit'):
+        time.sleep(0.01)
+        with instrumentation.stage('encode'):
+            time.sleep(0.02)
+    layer = instrumentation.end_layer("G1 Y1\nG1 Y2\n")
+    instrumentation.stop()
+
+    # the time of the nested stage is not counted in the outer stage
+    assert 0.01 <= layer['emit'] < 0.02
+    assert layer['encode'] >= 0.02
+    assert layer['total'] >= layer['emit'] + layer['encode']
+    assert (layer['layer'], layer['input bytes'], layer['output bytes'], layer['output lines']) == (1, 100, 12, 2)
+    stats = instrumentation.statistics()
+    assert stats['emit time'] == layer['emit']
+    assert stats['slowest layer'].startswith("1 ")
+
+def test_process_gcode_instrumented(tmp_path):
+    cfg = Config.from_file('machine.toml')
+    with open("test/test_1_input.gcode", 'r') as f:
+        gcode = f.read()
+    expected = process_gcode(gcode, cfg)['gcode']
+
+    for jobs in (1, 2):
+        instrumentation = Instrumentation(trace_memory=(jobs == 1))
+        output = process_gcode(gcode, cfg, jobs, options=JobOptions(instrumentation=instrumentation))
+        same_output = output['gcode'] == expected
+        assert same_output
+        assert [layer['layer'] for layer in instrumentation.layers] == list(range(1, 11))
+        stats = output['statistics']
+        for stage in STAGES:
+            assert stats[f"{stage} time"] > 0
+        assert stats['output lines/sec'] > 0
+    assert stats['input bytes/sec'] > 0
+    assert 'tracemalloc peak (MB)' not in stats
+
+    instrumentation.save(str(tmp_path / "layers.csv"))
+    with open(tmp_path / "layers.csv", newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == 10 and rows[0]['layer'] == "1"
+    instrumentation.save(str(tmp_path / "layers.json"))
+    with open(tmp_path / "layers.json") as f:
+        assert len(json.load(f)['layers']) == 10
@@ -0,0 +1,44 @@
+import pytest
+from config import Config
+from layer_index import LayerIndex
+from process import process_gcode, process_gcode_file
+
+def test_layer_index_save_load(tmp_path):
+    index = LayerIndex(file_size=100)
+    index.add(1, 10, 40, fill_percentage=1.5)
+    index.add(2, 50, 40, fill_percentage=0.0)
+    index.save(tmp_path / "index.json")
+
+    loaded = LayerIndex.load(tmp_path / "index.json")
+    assert loaded.file_size == 100
+    assert loaded.get(2) == {'layer': 2, 'offset': 50, 'length': 40, 'fill_percentage': 0.0}
+    with pytest.raises(KeyError):
+        loaded.get(3)
+
+def test_read_layer_crlf(tmp_path):
+    # a file written in text mode on Windows, the offsets and lengths are in bytes
+    gcode_file = tmp_path / "crlf_processed.gcode"
+    gcode_file.write_bytes(b";Layer1\r\nG1 Y118\r\n;Layer2\r\nG1 Y119\r\n")
+    index = LayerIndex([{'layer': 1, 'offset': 0, 'length': 18}, {'layer': 2, 'offset': 18, 'length': 18}], 36)
+    assert index.is_valid_for(gcode_file)
+    assert index.read_layer(gcode_file, 2) == ";Layer2\nG1 Y119\n"
+
+def test_process_gcode_file_writes_index(tmp_path):
+    cfg = Config.from_file('machine.toml')
+    with open("test/test_1_input.gcode", 'r') as f:
+        expected = process_gcode(f.read(), cfg)['gcode']
+    layers = expected.split(";Layer")[1:]
+    layers[-1] = layers[-1].split("; total layers count")[0]
+
+    for jobs in (1, 2):
+        output_file = str(tmp_path / f"test_1_processed_{jobs}.gcode")
+        process_gcode_file("test/test_1_input.gcode", output_file, cfg, jobs=jobs)
+
+        index = LayerIndex.load(LayerIndex.index_path(output_file))
+        assert index.is_valid_for(output_file)
+        assert len(index.layers) == 10
+        for n in (1, 7, 10):
+            assert index.read_layer(output_file, n) == ";Layer" + layers[n-1]
+
+    process_gcode_file("test/test_1_input.gcode", str(tmp_path / "no_index.gcode"), cfg, write_index=False)
+    assert not (tmp_path / "no_index.gcode.index.json").exists()
@@ -0,0 +1,64 @@
+import csv
+import json
+import numpy as np
+from config import Config
+from pattern import Pattern, PackedPattern
+from process import process_gcode, JobOptions
+from layer_stats import LayerStatistics
+
+def test_measure():
+    cfg = Config.from_file('machine.toml')
+    cfg.nozzle_configuration.flow_rate = 6.0
+    row_time = 60 / cfg.machine_dimensions.y_feed_rate
+    p = Pattern(cfg.get_bed_array_size())
+    p[20, 100:200] = 1 # nozzle 10, first pass
+    p[21, 150:160] = 1 # nozzle 10, second pass
+    p[40:60, 300] = 1 # nozzles 20-29, a full row
+    stats = LayerStatistics(cfg, bins=4)
+    layer = stats.add_layer(0, p)
+
+    assert layer['open cells'] == 130
+    assert np.isclose(layer['open time (s)'], 130 * row_time)
+    assert np.isclose(layer['binder volume (ml)'], 130 * row_time * 6.0 / 60)
+    assert layer['active area (mm2)'] == 130 * cfg.bed_parameters.resolution_mm
+    assert (layer['column min'], layer['column max'], layer['row min'], layer['row max']) == (20, 59, 100, 300)
+    assert layer['fill histogram'] == [p.shape[1], 0, 0, 0]
+    assert np.isclose(stats.nozzle_open_time[10], 110 * row_time)
+    assert np.isclose(stats.nozzle_open_time[20:30].sum(), 20 * row_time)
+    assert np.isclose(stats.manifold_open_time()[1], 110 * row_time)
+    assert stats.statistics()['busiest nozzle'] == 10
+
+    # a packed pattern gives the same statistics
+    packed, packed_open_time = stats.measure(0, PackedPattern.from_pattern(p))
+    assert packed == layer
+    assert np.array_equal(packed_open_time, stats.nozzle_open_time)
+
+    empty = stats.add_layer(1, Pattern(cfg.get_bed_array_size()))
+    assert empty['open cells'] == 0 and empty['row min'] is None
+    assert stats.statistics()['empty layers'] == 1
+
+def test_process_gcode_layer_stats(tmp_path):
+    cfg = Config.from_file('machine.toml')
+    with open("test/test_1_input.gcode", 'r') as f:
+        gcode = f.read()
+    stats = LayerStatistics(cfg)
+    result = process_gcode(gcode, cfg, options=JobOptions(layer_stats=stats))
+    assert len(stats.layers) == 10
+    assert np.isclose(np.mean([layer['fill (%)'] for layer in stats.layers]), result['statistics']['Fill factor'])
+    assert 'nozzle open time max (s)' in result['statistics']
+
+    parallel = LayerStatistics(cfg)
+    process_gcode(gcode, cfg, jobs=2, options=JobOptions(layer_stats=parallel))
+    assert parallel.layers == stats.layers
+    assert np.allclose(parallel.nozzle_open_time, stats.nozzle_open_time)
+
+    stats.save(str(tmp_path / "layers.csv"))
+    with open(tmp_path / "layers.csv", newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == 10 and rows[0]['layer'] == '1' and 'fill 90-100%' in rows[0]
+    stats.save(str(tmp_path / "layers.json"))
+    with open(tmp_path / "layers.json") as f:
+        saved = json.load(f)
+    assert len(saved['nozzle open time (s)']) == cfg.get_bed_array_size()[0] // 2
+    assert len(saved['manifold open time (s)']) == 11
+    assert saved['layers'][0] == stats.layers[0]
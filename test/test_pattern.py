@@ -15,3 +15,56 @@ def test_pattern_out_of_bounds():
     #with pytest.raises(IndexError):
     p.add_line(0,0,13)
 
+
+import numpy as np
+
+def test_pattern_add_lines():
+    rng = np.random.default_rng(0)
+    columns = rng.integers(0, 20, size=200)
+    start_rows = rng.integers(0, 30, size=200)
+    end_rows = start_rows + rng.integers(0, 10, size=200)
+
+    p = Pattern((20, 40))
+    p.add_lines(columns, start_rows, end_rows)
+
+    r = Pattern((20, 40))
+    for column, start_row, end_row in zip(columns, start_rows, end_rows):
+        r.add_line(column, start_row, end_row)
+    assert (p == r).all()
+
+def test_pattern_add_lines_out_of_bounds():
+    p = Pattern((10,10))
+    p.add_lines([0, 1], [0, 5], [13, 8])
+    r = Pattern((10,10))
+    r.add_line(0, 0, 13)
+    r.add_line(1, 5, 8)
+    assert (p == r).all()
+
+from pattern import PackedPattern
+from util import encode_valve_rows
+
+def test_packed_pattern():
+    rng = np.random.default_rng(1)
+    p = Pattern((32, 40))
+    packed = PackedPattern((32, 40))
+    for column, start_row in zip(rng.integers(0, 32, size=50), rng.integers(0, 30, size=50)):
+        p.add_line(column, start_row, start_row + 5)
+        packed.add_line(column, start_row, start_row + 5)
+
+    assert (packed.to_pattern() == p).all()
+    assert packed.count_nonzero() == np.count_nonzero(p)
+    assert packed.fill_percentage() == np.count_nonzero(p) / p.size * 100
+
+    first_pass, second_pass = encode_valve_rows(p)
+    assert np.array_equal(packed.valve_bytes(), first_pass)
+    assert np.array_equal(packed.valve_bytes(second_pass=True), second_pass)
+    assert np.array_equal(PackedPattern.from_pattern(p).words, packed.words)
+
+    packed.clear()
+    assert packed.count_nonzero() == 0
+
+def test_packed_pattern_odd_columns():
+    p = Pattern((5, 10))
+    p.add_line(4, 0, 10)
+    p.add_line(1, 3, 4)
+    assert (PackedPattern.from_pattern(p).to_pattern() == p).all()
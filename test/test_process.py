@@ -1,7 +1,7 @@
 import pytest
 import numpy as np
 from config import Config
-from process import convert_pattern_row_to_gcode, convert_to_output, process_gcode
+from process import convert_pattern_row_to_gcode, convert_to_output, process_gcode, calculate_fill_percentage
 from pattern import Pattern
 
 config_data = {
@@ -173,4 +173,302 @@ def test_convert_to_output():
     p = arr.view(Pattern)
     
     out = convert_to_output(p, 1, cfg)
-    print(out)
\ No newline at end of file
+    print(out)
+
+from process import process_gcode_file, iter_layers, index_layers
+def test_process_gcode_file_matches_process_gcode(tmp_path):
+    cfg = Config.from_file('machine.toml')
+
+    TEST_INPUT_FILENAME = "test/test_1_input.gcode"
+    with open(TEST_INPUT_FILENAME, 'r') as f:
+        expected = process_gcode(f.read(), cfg)
+
+    for use_mmap in (False, True):
+        output_file = tmp_path / "test_1_processed.gcode"
+        stats = process_gcode_file(TEST_INPUT_FILENAME, output_file, cfg, use_mmap=use_mmap)
+
+        with open(output_file, 'r') as f:
+            assert f.read() == expected['gcode']
+        assert stats == expected['statistics']
+
+
+def test_iter_layers():
+    gcode = [";LAYER_COUNT:2", ";LAYER:0", "G1 X0 Y20", ";LAYER:1", "G1 X5 Y20"]
+    layers = list(iter_layers(gcode))
+    assert layers == [(2, ""), (0, ";LAYER:0\nG1 X0 Y20\n"), (1, ";LAYER:1\nG1 X5 Y20\n")]
+
+    with pytest.raises(ValueError):
+        list(iter_layers([";LAYER:0", "G1 X0 Y20"]))
+
+    with pytest.raises(ValueError):
+        list(iter_layers([";LAYER_COUNT:3", ";LAYER:0", "G1 X0 Y20"]))
+
+    # like index_layers, the first LAYER_COUNT anywhere in the file counts
+    gcode = ";LAYER:0\nG1 X0 Y20\n;LAYER:1\nG1 X5 Y20 ;LAYER_COUNT:2\n"
+    layers = list(iter_layers(gcode.splitlines()))
+    assert layers == [(2, ""), (0, ";LAYER:0\nG1 X0 Y20\n"), (1, ";LAYER:1\nG1 X5 Y20 ;LAYER_COUNT:2\n")]
+    assert index_layers(gcode.encode()) == (2, [0, 19])
+
+
+import io
+from process import ChunkSink, layer_end_cmd
+def test_convert_to_output_sink():
+    cfg = Config.from_file('machine.toml')
+    rng = np.random.default_rng(1)
+    p = rng.integers(0, 2, size=cfg.get_bed_array_size(), dtype=np.uint8).view(Pattern)
+
+    expected = convert_to_output(p, 3, cfg)
+
+    sink = ChunkSink()
+    assert convert_to_output(p, 3, cfg, sink) is None
+    assert sink.getvalue() == expected
+
+    f = io.StringIO()
+    convert_to_output(p, 3, cfg, f)
+    assert f.getvalue() == expected
+
+    assert layer_end_cmd(118, f) is None
+    assert f.getvalue() == expected + layer_end_cmd(118)
+
+
+def test_process_gcode_parallel():
+    cfg = Config.from_file('machine.toml')
+
+    with open("test/test_1_input.gcode", 'r') as f:
+        input_gcode = f.read()
+
+    serial = process_gcode(input_gcode, cfg)
+    parallel = process_gcode(input_gcode, cfg, jobs=2)
+    assert parallel['gcode'] == serial['gcode']
+    assert parallel['statistics'] == serial['statistics']
+
+
+from pattern import PackedPattern
+def test_convert_to_output_packed_pattern():
+    cfg = Config.from_file('machine.toml')
+    rng = np.random.default_rng(2)
+    p = rng.integers(0, 2, size=cfg.get_bed_array_size(), dtype=np.uint8).view(Pattern)
+    packed = PackedPattern.from_pattern(p)
+
+    assert convert_to_output(packed, 0, cfg) == convert_to_output(p, 0, cfg)
+    assert calculate_fill_percentage(packed) == calculate_fill_percentage(p)
+
+
+from process import index_layers
+def test_index_layers():
+    gcode = b";LAYER_COUNT:2\n;LAYER:0\nG1 X0 Y20\n;LAYER:1\nG1 X5 Y20\n"
+    assert index_layers(gcode) == (2, [15, 34])
+
+    with pytest.raises(ValueError):
+        index_layers(b";LAYER:0\nG1 X0 Y20\n")
+
+    with pytest.raises(ValueError):
+        index_layers(b";LAYER_COUNT:3\n;LAYER:0\nG1 X0 Y20\n")
+
+
+def test_process_gcode_file_mmap(tmp_path):
+    cfg = Config.from_file('machine.toml')
+    with open("test/test_1_input.gcode", 'r') as f:
+        expected = process_gcode(f.read(), cfg)
+
+    # windows line endings are handled without decoding the file
+    input_file = tmp_path / "test_1_crlf.gcode"
+    with open("test/test_1_input.gcode", 'rb') as f:
+        input_file.write_bytes(f.read().replace(b"\n", b"\r\n"))
+
+    for jobs in (1, 2):
+        output_file = tmp_path / f"test_1_processed_{jobs}.gcode"
+        stats = process_gcode_file(input_file, output_file, cfg, jobs=jobs, use_mmap=True)
+        with open(output_file, 'r') as f:
+            assert f.read() == expected['gcode']
+        assert stats == expected['statistics']
+
+    # errors during processing are not hidden by releasing the memory map
+    cfg.machine_dimensions.y_maximum_position = cfg.machine_dimensions.y_initial_position + 10
+    with pytest.raises(ValueError):
+        process_gcode_file(input_file, tmp_path / "error.gcode", cfg, use_mmap=True)
+
+    # on an error no partial output is left behind, and an earlier output is kept as it was
+    output_file = tmp_path / "test_1_processed_1.gcode"
+    for use_mmap in (False, True):
+        with pytest.raises(ValueError):
+            process_gcode_file(input_file, output_file, cfg, use_mmap=use_mmap)
+        with open(output_file, 'r') as f:
+            assert f.read() == expected['gcode']
+    assert not (tmp_path / "error.gcode").exists()
+    assert sorted(path.name for path in tmp_path.iterdir() if '.part' in path.name) == []
+
+from process import StrokeTemplate, convert_pattern_to_strokes, format_valve_row
+from util import encode_valve_rows
+def test_stroke_template():
+    # hopper reaches its home position halfway the first stroke, odd number of rows
+    cfg = Config.from_dict({'bed_parameters': {'x_size_mm': 80, 'y_size_mm': 31, 'resolution_mm': 5},
+                            'machine_dimensions': {'x_maximum_position': 130, 'y_initial_position': 115,
+                                                   'y_maximum_position': 200, 'y_feed_rate': 6000}})
+    rng = np.random.default_rng(2)
+    p = rng.integers(0, 2, size=cfg.get_bed_array_size(), dtype=np.uint8).view(Pattern)
+
+    # the strokes written one line at a time
+    first_pass, second_pass = encode_valve_rows(p)
+    expected = []
+    y, x, f = 115, 15, int(np.sqrt(2) * 6000)
+    for i in range(31):
+        expected.append(f"G1 Y{y} X{x} F{f}\n")
+        if i % 2 == 1:
+            expected.append(format_valve_row(first_pass[i]))
+        y += 1
+        x = 130 - y
+        if x < 0:
+            x, f = 0, 6000
+    expected.append(f"G1 Y{y} F6000\nVALVES_SET VALUES=0\nG1 Y{y+1}\nFILL_HOPPER_ASYNC\nSET_SECOND_PASS\nG4 P3000\n")
+    for i in reversed(range(31)):
+        expected.append(f"G1 Y{y}\n")
+        if (30 - i) % 2 == 1:
+            expected.append(format_valve_row(second_pass[i]))
+        y -= 1
+    # 16 columns: a single manifold per pass, also when closing all valves
+    expected.append("G1 Y115\nVALVES_SET VALUES=0\nG1 Y0\n")
+
+    assert convert_pattern_to_strokes(p, cfg) == "".join(expected)
+    # the template is built once per machine dimensions and number of rows
+    assert StrokeTemplate.for_config(cfg, 31) is StrokeTemplate.for_config(cfg, 31)
+    assert StrokeTemplate.for_config(cfg, 31) is not StrokeTemplate.for_config(cfg, 30)
+
+from decoder import decode_layer_words, Verifier
+from process import JobOptions
+def test_convert_to_output_merge_rows():
+    cfg = Config.from_file('machine.toml')
+    merged_cfg = Config.from_file('machine.toml')
+    merged_cfg.output.merge_rows = True
+    rows = cfg.get_bed_array_size()[1]
+    # solid block with a few holes, so most rows repeat the valve state of the row before
+    p = Pattern(cfg.get_bed_array_size())
+    p[20:120, 300:900] = 1
+    p[40:50, 500:510] = 0
+
+    full = convert_to_output(p, 0, cfg)
+    merged = convert_to_output(p, 0, merged_cfg)
+    assert merged.count("\n") < full.count("\n") / 20
+    # every line of the merged output is a line of the full output, in the same order
+    full_lines = iter(full.splitlines())
+    assert all(line in full_lines for line in merged.splitlines())
+    # the first and last move, and the move where the hopper arrives home are kept
+    assert merged.splitlines()[8] == full.splitlines()[8]
+    assert "G1 Y1388 X0 F8679" in merged
+    # the valves are in the same state on every row of both strokes
+    for w_full, w_merged in zip(decode_layer_words(full, cfg)[0], decode_layer_words(merged, cfg)[0]):
+        assert (w_full == w_merged).all()
+    assert Verifier(merged_cfg).check_layer(0, merged, p)
+
+    # an empty layer has only the breakpoint moves
+    empty = convert_to_output(Pattern(cfg.get_bed_array_size()), 0, merged_cfg)
+    assert "VALVES_SET VALUES=0" in empty and empty.count("VALVES_SET") == 2
+    assert empty.count("\n") == 8 + 3 + 6 + 1 + 3 # begin, 3 forward moves, return, 1 back move, end
+
+def test_process_gcode_merge_rows():
+    cfg = Config.from_file('machine.toml')
+    cfg.output.merge_rows = True
+    with open("test/test_1_input.gcode", 'r') as f:
+        gcode = f.read()
+    verifier = Verifier(cfg)
+    stats = process_gcode(gcode, cfg, options=JobOptions(verifier=verifier))['statistics']
+    assert verifier.mismatches == []
+    assert stats['layer commands'] < stats['layer commands unmerged']
+    assert stats['command reduction (%)'] > 50
+    assert process_gcode(gcode, cfg, jobs=2)['statistics']['layer commands'] == stats['layer commands']
+
+def test_convert_to_output_trim_strokes():
+    cfg = Config.from_file('machine.toml')
+    trimmed_cfg = Config.from_file('machine.toml')
+    trimmed_cfg.output.trim_strokes = True
+    p = Pattern(cfg.get_bed_array_size())
+    p[20:120, 300:500] = 1
+    p[50, 700:720] = 1
+
+    full = convert_to_output(p, 0, cfg)
+    trimmed = convert_to_output(p, 0, trimmed_cfg)
+    assert trimmed.count("\n") < full.count("\n") / 2
+    assert trimmed == convert_to_output(PackedPattern.from_pattern(p), 0, trimmed_cfg)
+    full_lines = iter(full.splitlines())
+    assert all(line in full_lines for line in trimmed.splitlines())
+    for w_full, w_trimmed in zip(decode_layer_words(full, cfg)[0], decode_layer_words(trimmed, cfg)[0]):
+        assert (w_full == w_trimmed).all()
+    assert Verifier(trimmed_cfg).check_layer(0, trimmed, p)
+
+    # the back stroke travels through its empty margins at the travel feedrate
+    trimmed_cfg.output.travel_feed_rate = 9000
+    travel = convert_to_output(p, 0, trimmed_cfg)
+    assert travel.count(" F9000\n") == 2
+    assert f" F{cfg.machine_dimensions.y_feed_rate}\n" in travel.split("SET_SECOND_PASS")[1]
+    assert Verifier(trimmed_cfg).check_layer(0, travel, p)
+
+    # an empty layer only deposits material: no valve changes, no back stroke
+    empty_pattern = Pattern(cfg.get_bed_array_size())
+    empty = convert_to_output(empty_pattern, 0, trimmed_cfg)
+    assert "SET_SECOND_PASS" not in empty and empty.count("VALVES_SET") == 1
+    assert empty.count("\n") == 8 + 3 + 1 + 3 # begin, 3 forward moves, hopper refill, end
+    assert "G1 Y1388 X0 F8679" in empty
+    assert f"G1 Y{cfg.machine_dimensions.y_initial_position} F9000\n" in empty
+    assert Verifier(trimmed_cfg).check_layer(0, empty, empty_pattern)
+
+    # the hopper doesn't reach home before the end of the stroke, so the last forward move is at
+    # the combined feedrate and the move back has to set the feedrate again
+    trimmed_cfg.output.travel_feed_rate = 0
+    trimmed_cfg.machine_dimensions.x_maximum_position = 2000
+    empty = convert_to_output(empty_pattern, 0, trimmed_cfg)
+    forward, back = empty.rsplit("FILL_HOPPER_ASYNC\n", 1)
+    assert forward.rstrip().endswith("F8679")
+    assert back.startswith(f"G1 Y{cfg.machine_dimensions.y_initial_position} F{cfg.machine_dimensions.y_feed_rate}\n")
+
+def test_process_gcode_trim_strokes():
+    cfg = Config.from_file('machine.toml')
+    cfg.output.trim_strokes = True
+    with open("test/test_1_input.gcode", 'r') as f:
+        gcode = f.read()
+    verifier = Verifier(cfg)
+    stats = process_gcode(gcode, cfg, options=JobOptions(verifier=verifier))['statistics']
+    assert verifier.mismatches == []
+    assert stats['layer commands'] < stats['layer commands unmerged']
+
+from config import NozzleConfiguration
+def test_convert_to_output_nozzle_configuration():
+    cfg = Config.from_file('machine.toml')
+    # 88 nozzles in manifolds of 4: 22 values per VALVES_SET, also when closing all valves
+    cfg.nozzle_configuration = NozzleConfiguration(88, 4, 2)
+    p = Pattern(cfg.get_bed_array_size())
+    p[10:100:3, 200:600] = 1
+    output = convert_to_output(p, 0, cfg)
+    assert all(line.count(",") == 21 for line in output.splitlines() if line.startswith("VALVES_SET"))
+    assert Verifier(cfg).check_layer(0, output, p)
+
+    cfg.nozzle_configuration = NozzleConfiguration(59, 8, 3)
+    with pytest.raises(ValueError):
+        convert_to_output(Pattern(cfg.get_bed_array_size()), 0, cfg)
+
+from gcode import GCodeMove, MoveBuffer
+from process import scan_end_position
+def test_scan_end_position():
+    def parsed_end_position(gcode, start):
+        end_pos = GCodeMove(start.X, start.Y, start.Z, start.E)
+        MoveBuffer.from_gcode(gcode).update_position(end_pos)
+        return end_pos
+
+    with open("test/test_1_input.gcode", 'r') as f:
+        layers = [layer for _, layer in list(iter_layers(f))[1:]]
+    layers += ["", "G1 X5 Y0 E0\nG0 Z3\n", "G1 X1 Y2 Z0.3 E5\nG1 X2\nM104\nG1 E3\n", "G1 X1 Y2 Z0.3 E5\nG1 Xbad Y7\n",
+               "G1 Z4 E2\r\nG1 X1\r\n", "G0\tZ2 X1\nM117 Z9\n;Z5\nG1 X1 ; Z7\n", "G1 Z3 X1\nG1 Z0 Y4\nG1 Zbad Y5\nG1 E4\n"]
+    start = GCodeMove(0, 0, 0, 0)
+    for layer in layers:
+        expected = parsed_end_position(layer, start)
+        for gcode in (layer, layer.encode()):
+            end_pos = scan_end_position(gcode, start)
+            assert (end_pos.X, end_pos.Y, end_pos.Z, end_pos.E) == (expected.X, expected.Y, expected.Z, expected.E)
+        start = expected
+
+def test_convert_gcode_to_pattern_x_mismatch_warning(caplog):
+    cfg = Config.from_file('machine.toml')
+    gcode = "G0 X10 Y10\nG1 X10 Y50 Z0.3 E1.5\nG1 X20 Y60 E2.5\n"
+    with caplog.at_level('WARNING'):
+        convert_gcode_to_pattern(gcode, cfg, GCodeMove(0, 0, 0, 0))
+    assert caplog.messages == ["Begin and end coordinates do not have the same X-value "
+                               "(current: (10.0, 50.0, 0.3), target: (20.0, 60.0, 2.5))"]
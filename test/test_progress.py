@@ -0,0 +1,39 @@
+import io
+from progress import ProgressReporter, format_duration
+from config import Config
+from process import process_gcode, JobOptions
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_format_duration():
+    assert format_duration(75.9) == "01:15"
+    assert format_duration(3 * 3600 + 61) == "3:01:01"
+
+def test_progress_reporter_is_throttled():
+    clock = FakeClock()
+    stream = io.StringIO()
+    progress = ProgressReporter(stream, interval=1.0, clock=clock)
+    progress(0, 100)
+    for i in range(1, 101):
+        clock.now = i * 0.1
+        progress(i, 100)
+    lines = stream.getvalue().splitlines()
+    assert lines[0] == "Found 100 layers in gcode"
+    assert lines[1] == "Processing layer 1/100 (1%), 10.0 layers/s, ETA 00:09"
+    # one update per second of processing, and always the last one
+    assert len(lines) == 2 + 10
+    assert lines[-1] == "Processing layer 100/100 (100%), 10.0 layers/s, done in 00:10"
+
+def test_process_gcode_progress():
+    cfg = Config.from_file('machine.toml')
+    with open("test/test_1_input.gcode", 'r') as f:
+        gcode = f.read()
+    for jobs in (1, 2):
+        calls = []
+        process_gcode(gcode, cfg, jobs, options=JobOptions(progress=lambda done, total: calls.append((done, total))))
+        assert calls == [(i, 10) for i in range(11)]
@@ -1,4 +1,5 @@
-from util import reverse_8_bits, list_of_bits_to_list_of_int, extract_every_second_bit
+from util import reverse_8_bits, list_of_bits_to_list_of_int, extract_every_second_bit, encode_valve_rows
+import pytest
 import bitstring
 import numpy as np
 
@@ -57,4 +58,68 @@ def test_list_of_bits_to_list_of_int():
 
     # Test alternating bytes
     bits = np.array([1,0,1,0,1,0,1,0, 0,1,0,1,0,1,0,1])  # [170, 85]
-    assert np.array_equal(list_of_bits_to_list_of_int(bits), np.array([170, 85], dtype=np.uint8))
\ No newline at end of file
+    assert np.array_equal(list_of_bits_to_list_of_int(bits), np.array([170, 85], dtype=np.uint8))
+
+def test_encode_valve_rows():
+    rng = np.random.default_rng(0)
+    pattern = rng.integers(0, 2, size=(176, 30), dtype=np.uint8)
+    first_pass, second_pass = encode_valve_rows(pattern)
+    assert first_pass.shape == (30, 11)
+    assert second_pass.shape == (30, 11)
+    for i, row in enumerate(pattern.T):
+        assert np.array_equal(first_pass[i], list_of_bits_to_list_of_int(row[::2]))
+        assert np.array_equal(second_pass[i], list_of_bits_to_list_of_int(row[1::2]))
+
+    with pytest.raises(ValueError):
+        encode_valve_rows(np.zeros((20, 4), dtype=np.uint8))
+
+
+from util import list_of_int_to_list_of_bits
+def test_list_of_int_to_list_of_bits():
+    values = np.array([170, 15, 0, 255], dtype=np.uint8)
+    bits = list_of_int_to_list_of_bits(values)
+    assert np.array_equal(list_of_bits_to_list_of_int(bits), values)
+    assert bits[:8].tolist() == [1,0,1,0,1,0,1,0]
+
+from util import ValveEncoder
+from config import NozzleConfiguration
+from pattern import PackedPattern
+def test_valve_encoder():
+    rng = np.random.default_rng(1)
+    pattern = rng.integers(0, 2, size=(176, 30), dtype=np.uint8)
+
+    # the configuration of the Asterix 1.0 and the legacy layout are the same as encode_valve_rows
+    legacy = encode_valve_rows(pattern)
+    for nozzles in (NozzleConfiguration(88, 8, 2), None):
+        encoder = ValveEncoder(176, nozzles)
+        words = encoder.encode(pattern)
+        assert words.shape == (2, 30, 11)
+        assert np.array_equal(words[0], legacy[0]) and np.array_equal(words[1], legacy[1])
+        assert np.array_equal(encoder.encode(PackedPattern.from_pattern(pattern)), words)
+        assert np.array_equal(encoder.decode(words), pattern)
+
+    # 3 passes, manifolds of 6 nozzles: column c is printed by nozzle c // 3 in pass c % 3
+    encoder = ValveEncoder(90, NozzleConfiguration(30, 6, 3))
+    assert encoder.values == 5
+    pattern = rng.integers(0, 2, size=(90, 20), dtype=np.uint8)
+    words = encoder.encode(pattern)
+    assert words.shape == (3, 20, 5)
+    for p in range(3):
+        for row in range(20):
+            nozzle_bits = pattern[p::3, row].reshape(5, 6)
+            expected = [list_of_bits_to_list_of_int(np.concatenate((bits, [0, 0])))[0] for bits in nozzle_bits]
+            assert words[p, row].tolist() == expected
+    assert np.array_equal(encoder.decode(words), pattern)
+    assert np.array_equal(encoder.encode(PackedPattern.from_pattern(pattern)), words)
+
+    # a pattern narrower than the head leaves the remaining nozzles closed
+    encoder = ValveEncoder(170, NozzleConfiguration(88, 8, 2))
+    words = encoder.encode(pattern=rng.integers(0, 2, size=(170, 10), dtype=np.uint8))
+    assert words.shape == (2, 10, 11) and not (words[:, :, -1] & 0b11).any()
+
+    with pytest.raises(ValueError):
+        ValveEncoder(180, NozzleConfiguration(88, 8, 2)) # more columns than nozzles
+    with pytest.raises(ValueError):
+        ValveEncoder(20) # legacy layout needs multiples of 8 nozzles per pass
+    with pytest.raises(ValueError):
+        ValveEncoder(32, NozzleConfiguration(16, 16, 2)) # a manifold is one byte
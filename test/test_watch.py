@@ -0,0 +1,47 @@
+import os
+import shutil
+from config import Config
+from watch import FolderWatcher
+
+def test_folder_watcher(tmp_path):
+    cfg = Config.from_file('machine.toml')
+    shutil.copy("test/test_1_input.gcode", tmp_path / "a.gcode")
+    watcher = FolderWatcher(str(tmp_path), cfg)
+    try:
+        # a file is only picked up when it didn't change since the previous poll
+        watcher.poll()
+        assert not watcher._running
+        watcher.poll()
+        assert watcher._running
+        finished = watcher.wait()
+        assert [s['error'] for s in finished] == [None]
+        assert sorted(os.listdir(tmp_path)) == ["a.gcode", "a_processed.gcode", "a_processed.gcode.index.json",
+                                                "a_processed.stats.json"]
+
+        # nothing new: processed files are not picked up again
+        watcher.poll()
+        watcher.poll()
+        assert not watcher._running
+    finally:
+        watcher.close()
+
+    # a restarted watcher skips files whose output is up to date
+    watcher = FolderWatcher(str(tmp_path), cfg)
+    try:
+        watcher.poll()
+        watcher.poll()
+        assert not watcher._running
+    finally:
+        watcher.close()
+
+def test_folder_watcher_layer_stats(tmp_path):
+    cfg = Config.from_file('machine.toml')
+    shutil.copy("test/test_1_input.gcode", tmp_path / "a.gcode")
+    watcher = FolderWatcher(str(tmp_path), cfg, layer_stats=True)
+    try:
+        watcher.poll()
+        watcher.poll()
+        assert [s['error'] for s in watcher.wait()] == [None]
+        assert (tmp_path / "a_processed.layers.json").exists()
+    finally:
+        watcher.close()
@@ -1,6 +1,7 @@
-import bitstring
 import numpy as np
 import numpy.typing as npt
+from config import Config, NozzleConfiguration
+from pattern import PackedPattern
 
 def extract_every_second_bit_from_byte(input: np.uint8, even_bits: bool = True) -> int:
     """Extract every second bit from a byte.
@@ -42,12 +43,13 @@ def extract_every_second_bit(input: list[np.uint8], even_bits: bool = True) -> l
     return output
 
 
+# lookup table with the bit-reversed value of every byte
+_REVERSED_BYTES = np.array([int(format(n, '08b')[::-1], 2) for n in range(256)], dtype=np.uint8)
+
 def reverse_8_bits(n: np.uint8):
-    # returns a bitstring with the bits reversed
+    # returns the value with the bits reversed
     if (n < 256):
-        b = format(n, '08b')
-        b = bitstring.BitArray(bin=b[::-1])
-        return b.uint
+        return int(_REVERSED_BYTES[n])
     else:
         raise(ValueError(f"Provided value is larger than 8 bits (value: {n} > 256)"))
 
@@ -59,18 +61,137 @@ def list_of_bits_to_list_of_int(bits: np.ndarray[np.uint8]) -> np.ndarray[np.uin
         
     Returns:
         Numpy array of n unsigned integers, where each integer is created from 8 consecutive bits
+        (first bit is the most significant bit)
     """
     if len(bits)%8:
         raise ValueError(f"length of input must be multiple of 8 (length is {len(bits)})")
-    result = np.zeros(len(bits)//8, dtype=np.uint8)
-    for i in range(0, len(bits), 8):
-        val = 0
-        for j in range(8):
-            val |= (bits[i+j] << j)
-        if val > 0:
-            pass
-        result[i//8] = reverse_8_bits(val)
-    return result
+    return np.packbits(np.asarray(bits) != 0)
+
+def encode_valve_rows(pattern: np.ndarray[np.uint8]) -> tuple[np.ndarray[np.uint8], np.ndarray[np.uint8]]:
+    """Encode a whole pattern into valve bytes for both passes in one call.
+
+    The first pass uses the even nozzles (pattern[::2]), the second pass the odd nozzles
+    (pattern[1::2]). Every pattern row becomes one row of valve bytes, packed the same way as
+    list_of_bits_to_list_of_int.
+
+    Args:
+        pattern: 2D array of 1s and 0s, indexed as [nozzle, row], or a PackedPattern
+
+    Returns:
+        Tuple of two 2D uint8 arrays (first pass, second pass), indexed as [row, byte]
+    """
+    first_pass, second_pass = ValveEncoder(pattern.shape[0]).encode(pattern)
+    return first_pass, second_pass
+
+# weight of every bit of a VALVES_SET value, first nozzle in the most significant bit
+_BIT_WEIGHTS = np.array([128, 64, 32, 16, 8, 4, 2, 1], dtype=np.uint8)
+
+class ValveEncoder:
+    """Encodes patterns into the VALVES_SET values of every pass, with the nozzle layout of the print head
+
+    Pattern column c is printed in pass c % passes by nozzle c // passes (the head shifts by a
+    column between the passes). The nozzles are grouped into manifolds of nozzles_per_manifold,
+    and every manifold is one VALVES_SET value, with its first nozzle in the most significant bit.
+    The layout is precomputed as a gather index with the pattern column of every (pass, manifold,
+    bit), so a whole layer is encoded with a single fancy index and a packing step.
+
+    When the NozzleConfiguration values are 0, the legacy layout of the Asterix 1.0 is used: 2
+    passes, manifolds of 8 nozzles, and as many nozzles as the pattern needs, which must be a
+    multiple of 8 per pass.
+
+    Attributes:
+        columns: number of pattern columns
+        passes: number of passes
+        nozzles: number of nozzles of the print head
+        nozzles_per_manifold: number of nozzles per manifold (at most 8)
+        values: number of VALVES_SET values (manifolds) per pass
+        index: (passes, values * 8) array with the pattern column of every bit, -1 for unused bits
+    """
+    _encoders = {}
+
+    def __init__(self, columns: int, nozzle_configuration: NozzleConfiguration | None = None):
+        nozzles = nozzle_configuration or NozzleConfiguration()
+        legacy = not (nozzles.total_nozzles or nozzles.nozzles_per_manifold or nozzles.number_of_passes)
+        self.columns = columns
+        self.passes = nozzles.number_of_passes or 2
+        self.nozzles = nozzles.total_nozzles or -(-columns // self.passes)
+        self.nozzles_per_manifold = nozzles.nozzles_per_manifold or 8
+        if legacy and (columns // 2 % 8 or self.nozzles % 8):
+            raise ValueError(f"number of nozzles per pass must be multiple of 8 (pattern has {columns} nozzles)")
+        if self.nozzles_per_manifold > 8:
+            raise ValueError(f"a manifold can have at most 8 nozzles (configured: {self.nozzles_per_manifold})")
+        if columns > self.nozzles * self.passes:
+            raise ValueError(f"pattern has {columns} columns, but {self.nozzles} nozzles in {self.passes} passes "
+                             f"only print {self.nozzles * self.passes}")
+        self.values = -(-self.nozzles // self.nozzles_per_manifold)
+
+        manifold, bit = np.divmod(np.arange(self.values * 8), 8)
+        nozzle = manifold * self.nozzles_per_manifold + bit
+        index = nozzle * self.passes + np.arange(self.passes)[:, np.newaxis]
+        unused = (bit >= self.nozzles_per_manifold) | (nozzle >= self.nozzles) | (index >= columns)
+        self.index = np.where(unused, -1, index)
+        self._gather = np.where(unused, 0, index)
+        self._unused = unused if unused.any() else None
+
+    @classmethod
+    def for_config(cls, config: Config, columns: int | None = None) -> 'ValveEncoder':
+        """Returns the (cached) encoder for the nozzle configuration, columns defaults to the columns of the print bed"""
+        columns = config.get_bed_array_size()[0] if columns is None else columns
+        key = (columns, config.nozzle_configuration.total_nozzles, config.nozzle_configuration.nozzles_per_manifold,
+               config.nozzle_configuration.number_of_passes)
+        encoder = cls._encoders.get(key)
+        if encoder is None:
+            encoder = cls._encoders[key] = cls(columns, config.nozzle_configuration)
+        return encoder
+
+    def encode(self, pattern: np.ndarray[np.uint8]) -> np.ndarray[np.uint8]:
+        """Encodes a pattern into the valve bytes of every pass
+
+        Args:
+            pattern: 2D array of 1s and 0s, indexed as [nozzle, row], or a PackedPattern
+
+        Returns:
+            (passes, rows, values) uint8 array, the valve bytes of every pass as [row, byte]
+        """
+        if isinstance(pattern, PackedPattern):
+            if self.passes == 2 and self.nozzles_per_manifold == 8 and pattern.shape[0] == self.columns:
+                # already packed in this layout
+                words = pattern.words
+                if words.shape[2] != self.values:
+                    words = np.pad(words, ((0, 0), (0, 0), (0, self.values - words.shape[2])))
+                return words
+            pattern = pattern.to_pattern()
+        if pattern.shape[0] != self.columns:
+            raise ValueError(f"pattern has {pattern.shape[0]} columns, the encoder expects {self.columns}")
+        bits = np.asarray(pattern)[self._gather] != 0
+        if self._unused is not None:
+            bits[self._unused] = False
+        # packing as a weighted sum of the 8 bits of every value is several times faster than
+        # np.packbits along the (strided) nozzle axis
+        bits = bits.view(np.uint8).reshape(self.passes, self.values, 8, -1)
+        return np.einsum('pvbr,b->prv', bits, _BIT_WEIGHTS, dtype=np.uint8).copy()
+
+    def decode(self, words: np.ndarray[np.uint8] | list[np.ndarray[np.uint8]]) -> np.ndarray[np.uint8]:
+        """Decodes the valve bytes of every pass ([row, byte] arrays) back into a [nozzle, row] pattern"""
+        bits = np.unpackbits(np.asarray(words), axis=2, count=self.values * 8)
+        pattern = np.zeros((self.columns, bits.shape[1]), dtype=np.uint8)
+        used = self.index >= 0
+        pattern[self.index[used]] = bits.transpose(0, 2, 1)[used]
+        return pattern
+
+def active_row_range(pattern: np.ndarray[np.uint8]) -> tuple[int, int]:
+    """Returns the range (start, stop) of the pattern rows with at least one cell set, (0, 0) for an empty pattern
+
+    Args:
+        pattern: 2D array of 1s and 0s, indexed as [nozzle, row], or a PackedPattern
+    """
+    if isinstance(pattern, PackedPattern):
+        active = np.flatnonzero(pattern.words.any(axis=(0, 2)))
+    else:
+        active = np.flatnonzero(np.asarray(pattern).any(axis=0))
+    if not len(active):
+        return 0, 0
+    return int(active[0]), int(active[-1]) + 1
 
 def list_of_int_to_list_of_bits(values: np.ndarray[np.uint8]) -> np.ndarray[np.uint8]:
     """Convert a numpy array of unsigned integers to a numpy array of bits.
@@ -81,9 +202,4 @@ def list_of_int_to_list_of_bits(values: np.ndarray[np.uint8]) -> np.ndarray[np.u
     Returns:
         Numpy array of length n*8 containing the individual bits from each integer
     """
-    result = np.zeros(len(values) * 8, dtype=np.uint8)
-    for i, val in enumerate(values):
-        val = reverse_8_bits(val)  # Reverse bits to maintain consistency with list_of_bits_to_list_of_int
-        for j in range(8):
-            result[i*8 + j] = (val >> j) & 1
-    return result
+    return np.unpackbits(np.asarray(values, dtype=np.uint8))
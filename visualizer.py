@@ -1,5 +1,6 @@
 import tkinter as tk
 from tkinter import filedialog
+import os
 import re
 
 import numpy as np
@@ -7,6 +8,7 @@ import matplotlib.pyplot as plt
 
 from config import Config
 from util import list_of_int_to_list_of_bits
+from layer_index import LayerIndex
 
 def extract_layer_data(p):
     # Create a root window and hide it
@@ -47,8 +49,18 @@ def extract_layer_data(p):
     
     try:
         with open(file_path, 'r') as file:
+            lines = file
+            # with a valid sidecar index, seek directly to the layer instead of scanning the file
+            index_path = LayerIndex.index_path(file_path)
+            if os.path.exists(index_path):
+                index = LayerIndex.load(index_path)
+                if index.is_valid_for(file_path):
+                    try:
+                        lines = index.read_layer(file_path, layer_number).splitlines()
+                    except KeyError:
+                        pass # not in the index, scan the file
             going_up = True
-            for line in file:
+            for line in lines:
                 # Check if we've entered the target layer
                 if layer_start_pattern in line:
                     in_target_layer = True
@@ -0,0 +1,137 @@
+from concurrent.futures import ProcessPoolExecutor, Future, wait
+import logging
+import os
+import signal
+import time
+from config import Config
+from cli import process_file, output_path
+
+logger = logging.getLogger(__name__)
+
+def _ignore_interrupt():
+    """Worker initializer: Ctrl+C stops the watcher, which lets the running jobs finish"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+class FolderWatcher:
+    """Watches a folder and processes every new (or changed) gcode file that lands in it.
+
+    The folder is polled every `interval` seconds. A file is processed once its size and
+    modification time are the same on two polls in a row, so files that are still being
+    written are left alone. The files are processed by a pool of `jobs` worker processes
+    that is kept alive between jobs, so the interpreter, numpy and the parsed Config are
+    only loaded once. Processed files (*_processed.gcode) are never picked up again.
+
+    Attributes:
+        directory: the watched folder
+        cfg: machine configuration
+        jobs: number of files processed in parallel
+        out_dir: folder the processed files are written to (None = next to the input files)
+        interval: seconds between two polls
+    """
+
+    def __init__(self, directory: str, cfg: Config, jobs: int = 1, out_dir: str | None = None, interval: float = 1.0,
+                 cache_size: int = 64, cache_dir: str | None = None, verify: bool = False, layer_stats: bool = False):
+        self.directory = directory
+        self.cfg = cfg
+        self.jobs = jobs
+        self.out_dir = out_dir
+        self.interval = interval
+        self.options = (cache_size, cache_dir, verify, layer_stats)
+        self._executor = None
+        self._seen = {} # path -> (size, mtime) at the previous poll
+        self._done = {} # path -> (size, mtime) of the version that was processed
+        self._running = {} # future -> path
+
+    def _is_input(self, name: str) -> bool:
+        return name.endswith('.gcode') and not name.endswith('_processed.gcode')
+
+    def _is_up_to_date(self, path: str, mtime: float) -> bool:
+        """True when the output of path exists and is newer than path (e.g. processed before a restart)"""
+        try:
+            return os.path.getmtime(output_path(path, self.out_dir)) >= mtime
+        except OSError:
+            return False
+
+    def ready_files(self) -> list[str]:
+        """Scans the folder and returns the files that are complete and not yet processed"""
+        ready = []
+        seen = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.is_file() or not self._is_input(entry.name):
+                    continue
+                stat = entry.stat()
+                state = (stat.st_size, stat.st_mtime)
+                seen[entry.path] = state
+                if self._seen.get(entry.path) != state or self._done.get(entry.path) == state:
+                    continue # still being written, or already processed
+                if entry.path in self._running.values():
+                    continue
+                if entry.path not in self._done and self._is_up_to_date(entry.path, stat.st_mtime):
+                    self._done[entry.path] = state
+                    continue
+                ready.append(entry.path)
+        self._seen = seen
+        return sorted(ready)
+
+    def poll(self) -> list[dict]:
+        """Collects the finished jobs and starts the jobs for files that are ready
+
+        Returns:
+            list: summaries of the jobs that finished since the previous poll (see cli.process_file)
+        """
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.jobs, initializer=_ignore_interrupt)
+        finished = self._collect([f for f in self._running if f.done()])
+
+        # keep the number of queued jobs bounded, the remaining files are picked up on a later poll
+        for path in self.ready_files()[:max(0, 2 * self.jobs - len(self._running))]:
+            logger.info(f"Processing {path}")
+            self._done[path] = self._seen[path]
+            future = self._executor.submit(process_file, path, self.cfg, self.out_dir, *self.options)
+            self._running[future] = path
+        return finished
+
+    def _collect(self, futures: list[Future]) -> list[dict]:
+        finished = []
+        for future in futures:
+            path = self._running.pop(future)
+            try:
+                summary = future.result()
+            except Exception as e:
+                logger.exception(f"Error processing {path}")
+                summary = {'input': path, 'output': None, 'statistics': {}, 'error': str(e)}
+            if summary['error'] is not None:
+                logger.error(f"Error processing {path}: {summary['error']}")
+            else:
+                logger.info(f"Processed {path} -> {summary['output']}")
+            finished.append(summary)
+        return finished
+
+    def wait(self) -> list[dict]:
+        """Waits for the running jobs and returns their summaries"""
+        wait(list(self._running))
+        return self._collect(list(self._running))
+
+    def close(self):
+        """Waits for the running jobs and stops the worker processes"""
+        self.wait()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def run(self, on_finished=None):
+        """Polls the folder until interrupted (Ctrl+C), on_finished is called with the summary of every finished job"""
+        try:
+            while True:
+                for summary in self.poll():
+                    if on_finished is not None:
+                        on_finished(summary)
+                time.sleep(self.interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for summary in self.wait():
+                if on_finished is not None:
+                    on_finished(summary)
+            self.close()